@@ -0,0 +1,43 @@
+import random
+from dataclasses import dataclass, field
+
+
+# benchmark dataset: ids are prefixed with the run id, so runs against the same database don't collide
+@dataclass
+class Dataset:
+    prefix: str
+    # team_name -> user_ids of the team, the first one is always active
+    teams: dict = field(default_factory=dict)
+    # pull_request_id -> assigned reviewers, filled when pull requests are created through the service
+    pull_requests: dict = field(default_factory=dict)
+    pull_requests_generated: int = 0
+
+    @property
+    def user_ids(self) -> list:
+        return [user_id for members in self.teams.values() for user_id in members]
+
+
+# /team/import bodies: teams of team_size users, about inactive_share of users are inactive
+def generate_teams(dataset: Dataset, teams_amount: int, team_size: int, rng: random.Random,
+                   inactive_share: float = 0.1, name: str = 'team') -> list[dict]:
+    teams = []
+    for team_number in range(teams_amount):
+        team_name = f'{dataset.prefix}_{name}{team_number}'
+        members = [{'user_id': f'{team_name}_u{user_number}', 'username': f'User {user_number} of {team_name}',
+                    'is_active': user_number == 0 or rng.random() >= inactive_share}
+                   for user_number in range(team_size)]
+        dataset.teams[team_name] = [member['user_id'] for member in members]
+        teams.append({'team_name': team_name, 'members': members})
+    return teams
+
+
+# /pullRequest/createMany items authored by random users of the given teams
+def generate_pull_requests(dataset: Dataset, amount: int, rng: random.Random, team_names: list | None = None,
+                           name: str = 'pr') -> list[dict]:
+    team_names = team_names or list(dataset.teams)
+    start = dataset.pull_requests_generated
+    dataset.pull_requests_generated += amount
+    return [{'pull_request_id': f'{dataset.prefix}_{name}{start + number}',
+             'pull_request_name': f'Pull request {start + number}',
+             'author_id': rng.choice(dataset.teams[rng.choice(team_names)])}
+            for number in range(amount)]
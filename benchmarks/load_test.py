@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from benchmarks.fixtures import Dataset
+from benchmarks.scenarios import SCENARIOS, RequestSpec, load_dataset
+from benchmarks.stats import Sample, read_jmeter_csv, write_jmeter_csv, summarize, group_by, format_report
+
+
+SERVICE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'service')
+
+
+# async load generator: `concurrency` workers send the prepared requests as fast as the service answers
+async def run_requests(client: httpx.AsyncClient, label: str, specs: list[RequestSpec],
+                       concurrency: int) -> list[Sample]:
+    samples = []
+    specs = iter(specs)
+
+    async def worker():
+        for spec in specs:
+            timestamp = int(time.time() * 1000)
+            started = time.perf_counter()
+            try:
+                response = await client.request(spec.method, spec.path, params=spec.params, json=spec.json)
+                await response.aread()
+                samples.append(Sample(timestamp, (time.perf_counter() - started) * 1000, label,
+                                      str(response.status_code), response.is_success, len(response.content),
+                                      str(response.url)))
+            except httpx.HTTPError as e:
+                samples.append(Sample(timestamp, (time.perf_counter() - started) * 1000, label, type(e).__name__,
+                                      False, 0, str(client.base_url.join(spec.path)), str(e)))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return samples
+
+
+# starts service/main.py with the current environment (DB_* variables) on the host and port of base_url
+async def start_service(base_url: str) -> subprocess.Popen:
+    url = urlsplit(base_url)
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=SERVICE_DIRECTORY,
+                               env={**os.environ, 'APP_HOST': url.hostname, 'APP_PORT': str(url.port or 80)})
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(120):
+            try:
+                await client.get('/docs')
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.25)
+    process.terminate()
+    raise RuntimeError('service did not start in 30 seconds')
+
+
+async def run(args) -> list[Sample]:
+    rng = random.Random(args.seed)
+    dataset = Dataset(prefix=args.prefix or f'bench{int(time.time())}')
+    process = await start_service(args.base_url) if args.start_service else None
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+            print(f'loading {args.teams} teams of {args.team_size} users and {args.pull_requests} pull requests '
+                  f'with prefix {dataset.prefix}', file=sys.stderr)
+            await load_dataset(client, dataset, args.teams, args.team_size, args.pull_requests, rng)
+
+            samples = []
+            for name in args.scenarios:
+                specs = await SCENARIOS[name](client, dataset, args.requests, rng)
+                print(f'running {name}: {len(specs)} requests, concurrency {args.concurrency}', file=sys.stderr)
+                samples.extend(await run_requests(client, name, specs, args.concurrency))
+            return samples
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the pull requests service')
+    parser.add_argument('--base-url', default='http://localhost:8080')
+    parser.add_argument('--start-service', action='store_true',
+                        help='start service/main.py, database settings are taken from the environment')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--team-size', type=int, default=20)
+    parser.add_argument('--pull-requests', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', help='ids prefix of generated data, unique per run by default')
+    parser.add_argument('--output', help='save samples to a JMeter format CSV file')
+    parser.add_argument('--baseline', nargs='*', default=[],
+                        help='JMeter CSV files (e.g. load_test_results/*.csv) to compare with by URL path')
+    parser.add_argument('--report-only', action='store_true',
+                        help="don't run the load, only report the --baseline files")
+    args = parser.parse_args()
+
+    summaries = {}
+    for path in args.baseline:
+        for url_path, samples in group_by(read_jmeter_csv(path), lambda sample: sample.path).items():
+            summaries[f'{os.path.basename(path)} {url_path}'] = summarize(samples)
+
+    if not args.report_only:
+        samples = asyncio.run(run(args))
+        if args.output:
+            write_jmeter_csv(args.output, samples, args.concurrency)
+        for label, label_samples in group_by(samples, lambda sample: sample.label).items():
+            summaries[f'{label} {label_samples[0].path}'] = summarize(label_samples)
+
+    print(format_report(summaries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'service'))
+
+from psycopg import AsyncConnection  # noqa: E402
+from psycopg.conninfo import make_conninfo  # noqa: E402
+from psycopg.rows import dict_row  # noqa: E402
+
+from api.users import REVIEW_QUERY  # noqa: E402
+from utils.db_queries import select_query  # noqa: E402
+from utils.reviewer_selection import PICK_REVIEWERS_QUERY  # noqa: E402
+from variables import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD  # noqa: E402
+
+
+# hot path reads of /pullRequest/create and /users/getReview, the queries are imported from the handlers,
+# parameters are taken from the database
+QUERIES = {
+    'create: author': ('SELECT user_id, team_name FROM "user" WHERE user_id = %(user_id)s', ('user_id',)),
+    'create: pick reviewers': (PICK_REVIEWERS_QUERY, ('team_name', 'excluded_users', 'amount')),
+    'getReview': (REVIEW_QUERY, ('user_id',)),
+}
+
+
+# microbenchmark of server-side prepared statements: the same queries through select_query as text (parsed and
+# planned by Postgres on every call) and prepared (planned once per connection, executed by statement name).
+# runs against the database from DB_* variables, which should contain data, e.g. after benchmarks/load_test.py
+# usage: python benchmarks/prepared_statements.py [repeats]
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    connection = await AsyncConnection.connect(
+        make_conninfo(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT),
+        row_factory=dict_row, autocommit=True
+    )
+    async with connection:
+        users = await select_query(connection, '''
+                                   SELECT user_id, team_name FROM "user" WHERE user_id IN (
+                                       SELECT reviewer_id FROM "assignment" ORDER BY pull_request_id LIMIT 100
+                                   )''')
+        if users is None:
+            sys.exit('database has no assignments, run benchmarks/load_test.py first')
+        parameters = [{'user_id': user['user_id'], 'team_name': user['team_name'],
+                       'excluded_users': [user['user_id']], 'amount': 2} for user in users]
+
+        for name, (query, parameter_names) in QUERIES.items():
+            results = {}
+            # the first round warms up caches of the server and the connection
+            for prepare in (False, True, False, True):
+                started = time.perf_counter()
+                for number in range(repeats):
+                    user_parameters = parameters[number % len(parameters)]
+                    await select_query(connection, query, {key: user_parameters[key] for key in parameter_names},
+                                       prepare=prepare)
+                results[prepare] = (time.perf_counter() - started) / repeats * 1_000_000
+            print(f'{name:<24} text {results[False]:8.1f} us   prepared {results[True]:8.1f} us   '
+                  f'{(1 - results[True] / results[False]) * 100:5.1f}% less per query')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+import random
+from dataclasses import dataclass
+
+import httpx
+
+from benchmarks.fixtures import Dataset, generate_teams, generate_pull_requests
+
+
+# items per /team/import and /pullRequest/createMany call when fixtures are loaded
+LOAD_BATCH_SIZE = 500
+
+
+@dataclass
+class RequestSpec:
+    method: str
+    path: str
+    params: dict | None = None
+    json: dict | list | None = None
+
+
+async def import_teams(client: httpx.AsyncClient, teams: list[dict]):
+    for start in range(0, len(teams), LOAD_BATCH_SIZE):
+        response = await client.post('/team/import', json=teams[start:start + LOAD_BATCH_SIZE])
+        response.raise_for_status()
+
+
+# assigned reviewers of created pull requests are saved to the dataset for reassign scenarios
+async def create_pull_requests(client: httpx.AsyncClient, dataset: Dataset, pull_requests: list[dict]):
+    for start in range(0, len(pull_requests), LOAD_BATCH_SIZE):
+        response = await client.post('/pullRequest/createMany',
+                                     json={'pull_requests': pull_requests[start:start + LOAD_BATCH_SIZE]})
+        response.raise_for_status()
+        for result in response.json()['results']:
+            if result['status'] == 200:
+                dataset.pull_requests[result['pull_request_id']] = result['pr']['assigned_reviewers']
+
+
+# base data every scenario runs against
+async def load_dataset(client: httpx.AsyncClient, dataset: Dataset, teams_amount: int, team_size: int,
+                       pull_requests_amount: int, rng: random.Random):
+    await import_teams(client, generate_teams(dataset, teams_amount, team_size, rng))
+    await create_pull_requests(client, dataset, generate_pull_requests(dataset, pull_requests_amount, rng))
+
+
+# every scenario prepares its own data if it needs any and returns requests to measure.
+# data changed by a scenario (merged pull requests, deactivated users) is created for it only,
+# so scenarios can be run in any order and combination
+
+async def team_import(client, dataset, amount, rng):
+    return [RequestSpec('POST', '/team/import',
+                        json=generate_teams(dataset, 10, 10, rng, name=f'import{number}_'))
+            for number in range(amount)]
+
+
+async def team_get(client, dataset, amount, rng):
+    team_names = list(dataset.teams)
+    return [RequestSpec('GET', '/team/get', params={'team_name': rng.choice(team_names)}) for _ in range(amount)]
+
+
+async def pull_request_create(client, dataset, amount, rng):
+    return [RequestSpec('POST', '/pullRequest/create', json=pull_request)
+            for pull_request in generate_pull_requests(dataset, amount, rng, name='create')]
+
+
+async def pull_request_merge(client, dataset, amount, rng):
+    pull_requests = generate_pull_requests(dataset, amount, rng, name='merge')
+    await create_pull_requests(client, dataset, pull_requests)
+    return [RequestSpec('POST', '/pullRequest/merge', json={'pull_request_id': pull_request['pull_request_id']})
+            for pull_request in pull_requests]
+
+
+async def pull_request_reassign(client, dataset, amount, rng):
+    pull_requests = generate_pull_requests(dataset, amount, rng, name='reassign')
+    await create_pull_requests(client, dataset, pull_requests)
+    return [RequestSpec('POST', '/pullRequest/reassign',
+                        json={'pull_request_id': pull_request['pull_request_id'],
+                              'old_user_id': dataset.pull_requests[pull_request['pull_request_id']][0]})
+            for pull_request in pull_requests if dataset.pull_requests.get(pull_request['pull_request_id'])]
+
+
+async def users_get_review(client, dataset, amount, rng):
+    user_ids = dataset.user_ids
+    return [RequestSpec('GET', '/users/getReview', params={'user_id': rng.choice(user_ids)}) for _ in range(amount)]
+
+
+# every request deactivates two reviewers of its own team with open pull requests to reassign
+async def users_deactivate_many(client, dataset, amount, rng):
+    teams = generate_teams(dataset, amount, 6, rng, inactive_share=0, name='deactivate')
+    await import_teams(client, teams)
+    team_names = [team['team_name'] for team in teams]
+    await create_pull_requests(client, dataset, generate_pull_requests(dataset, amount * 3, rng, team_names,
+                                                                       name='deactivate'))
+    return [RequestSpec('POST', '/users/deactivateMany', json={'users': dataset.teams[team_name][1:3]})
+            for team_name in team_names]
+
+
+# the endpoint of the JMeter baseline in load_test_results/
+async def statistics_reviewers_amount(client, dataset, amount, rng):
+    return [RequestSpec('GET', '/statistics/pull_request_reviewers_amount') for _ in range(amount)]
+
+
+async def statistics_reviewers_amount_by_id(client, dataset, amount, rng):
+    pull_request_ids = list(dataset.pull_requests)
+    return [RequestSpec('GET', '/statistics/pull_request_reviewers_amount',
+                        params={'pull_request_id': rng.choice(pull_request_ids)}) for _ in range(amount)]
+
+
+SCENARIOS = {
+    'team_import': team_import,
+    'team_get': team_get,
+    'pull_request_create': pull_request_create,
+    'pull_request_merge': pull_request_merge,
+    'pull_request_reassign': pull_request_reassign,
+    'users_get_review': users_get_review,
+    'users_deactivate_many': users_deactivate_many,
+    'statistics_reviewers_amount': statistics_reviewers_amount,
+    'statistics_reviewers_amount_by_id': statistics_reviewers_amount_by_id,
+}
@@ -0,0 +1,47 @@
+import os
+import sys
+import timeit
+from dataclasses import asdict
+from datetime import datetime
+
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'service'))
+
+from utils.responses import JSONResponse  # noqa: E402
+from utils.schemas import PullRequestShort  # noqa: E402
+from variables import JSON_DATETIME_FORMAT  # noqa: E402
+
+
+# microbenchmark of the response rendering of /users/getReview and /pullRequest/merge shaped bodies:
+# the old path (dict rows, strftime, stdlib json) against the current one (records, native datetimes, orjson)
+# usage: python benchmarks/serialization.py [rows] [repeats]
+def main():
+    rows_amount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    records = [PullRequestShort(f'pr-{i}', f'Pull request {i}', f'u{i % 50}', 'OPEN') for i in range(rows_amount)]
+    rows = [asdict(record) for record in records]
+    merged_at = datetime.now()
+
+    def legacy():
+        StarletteJSONResponse(status_code=200, content={'user_id': 'u1', 'members': [dict(row) for row in rows]})
+        StarletteJSONResponse(status_code=200, content={'pr': {
+            'pull_request_id': 'pr-1', 'status': 'MERGED', 'assigned_reviewers': ['u2', 'u3'],
+            'createdAt': merged_at.strftime(JSON_DATETIME_FORMAT), 'mergedAt': merged_at.strftime(JSON_DATETIME_FORMAT)
+        }})
+
+    def fast():
+        JSONResponse(status_code=200, content={'user_id': 'u1', 'members': records})
+        JSONResponse(status_code=200, content={'pr': {
+            'pull_request_id': 'pr-1', 'status': 'MERGED', 'assigned_reviewers': ['u2', 'u3'],
+            'createdAt': merged_at, 'mergedAt': merged_at
+        }})
+
+    for name, function in (('stdlib json + dicts', legacy), ('orjson + records', fast)):
+        seconds = min(timeit.repeat(function, number=repeats, repeat=5)) / repeats
+        print(f'{name:<22} {seconds * 1_000_000:10.1f} us per response pair ({rows_amount} rows)')
+
+
+if __name__ == '__main__':
+    main()
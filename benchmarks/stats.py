@@ -0,0 +1,97 @@
+import csv
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+
+JMETER_FIELDS = ['timeStamp', 'elapsed', 'label', 'responseCode', 'responseMessage', 'threadName', 'dataType',
+                 'success', 'failureMessage', 'bytes', 'sentBytes', 'grpThreads', 'allThreads', 'URL', 'Latency',
+                 'IdleTime', 'Connect']
+
+
+# one request result, fields are the subset of JMeter CSV columns the reports need
+@dataclass
+class Sample:
+    timestamp: int  # request start, ms since epoch
+    elapsed: float  # ms
+    label: str
+    code: str
+    success: bool
+    bytes: int
+    url: str
+    failure_message: str = ''
+
+    @property
+    def path(self) -> str:
+        return urlsplit(self.url).path
+
+
+# JMeter "Save as CSV" results (load_test_results/*.csv), response codes of failed connections aren't numeric
+def read_jmeter_csv(path: str) -> list[Sample]:
+    with open(path, newline='', encoding='utf-8') as file:
+        return [Sample(timestamp=int(row['timeStamp']), elapsed=float(row['elapsed']), label=row['label'],
+                       code=row['responseCode'], success=row['success'].lower() == 'true',
+                       bytes=int(row['bytes'] or 0), url=row['URL'], failure_message=row['failureMessage'])
+                for row in csv.DictReader(file)]
+
+
+# results are written in the JMeter format, so old and new runs are read and compared the same way
+def write_jmeter_csv(path: str, samples: list[Sample], threads: int):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(JMETER_FIELDS)
+        for sample in samples:
+            writer.writerow([sample.timestamp, round(sample.elapsed), sample.label, sample.code,
+                             'OK' if sample.success else 'ERROR', 'benchmark', 'text', str(sample.success).lower(),
+                             sample.failure_message, sample.bytes, 0, threads, threads, sample.url,
+                             round(sample.elapsed), 0, 0])
+
+
+# linear interpolation between closest ranks, values must be sorted
+def percentile(values: list, p: float) -> float | None:
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(samples: list[Sample]) -> dict:
+    elapsed = sorted(sample.elapsed for sample in samples)
+    errors = sum(not sample.success for sample in samples)
+    # wall time from the first request start to the last response end
+    duration = (max(sample.timestamp + sample.elapsed for sample in samples) -
+                min(sample.timestamp for sample in samples)) / 1000 if samples else 0
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0,
+        'throughput': len(samples) / duration if duration else 0,
+        'mean': sum(elapsed) / len(elapsed) if elapsed else None,
+        'p50': percentile(elapsed, 50),
+        'p95': percentile(elapsed, 95),
+        'p99': percentile(elapsed, 99),
+        'max': elapsed[-1] if elapsed else None,
+    }
+
+
+def group_by(samples: list[Sample], key) -> dict[str, list[Sample]]:
+    groups = {}
+    for sample in samples:
+        groups.setdefault(key(sample), []).append(sample)
+    return groups
+
+
+def format_report(summaries: dict[str, dict]) -> str:
+    def number(value, digits=1):
+        return '-' if value is None else f'{value:.{digits}f}'
+
+    header = (f'{"":<70} {"requests":>9} {"errors":>8} {"rps":>9} {"mean":>8} {"p50":>8} {"p95":>8} {"p99":>8} '
+              f'{"max":>8}')
+    lines = [header, '-' * len(header)]
+    for name, summary in summaries.items():
+        lines.append(f'{name:<70} {summary["requests"]:>9} {number(summary["error_rate"] * 100):>7}% '
+                     f'{number(summary["throughput"]):>9} {number(summary["mean"]):>8} {number(summary["p50"]):>8} '
+                     f'{number(summary["p95"]):>8} {number(summary["p99"]):>8} {number(summary["max"]):>8}')
+    lines.append('latencies are in ms, rps is requests per second')
+    return '\n'.join(lines)
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends
+from psycopg import AsyncConnection
+
+from utils.responses import JSONResponse
+from utils.properties import ErrorCodes
+from utils.schemas import ErrorResponse, Error
+from utils.db_queries import DatabaseSession, select_query, get_connection
+
+
+router = APIRouter()
+
+
+# status, progress and partial results of a background job (see utils/jobs.py).
+# it's read from the primary, a lagging replica would report a just enqueued job as not found
+@router.get("/{job_id}")
+async def get_job(job_id: str, connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    job = await select_query(connection, '''
+                             SELECT job_id, kind, status, progress, result, error, attempts, created_at, started_at,
+                                 finished_at
+                             FROM job WHERE job_id = %(job_id)s
+                             ''', {'job_id': job_id}, return_one=True, prepare=True, primary=True)
+    if job is None:
+        return JSONResponse(status_code=404, content=ErrorResponse(Error(
+            code=ErrorCodes.NOT_FOUND, message='job_id not found'
+        )).__dict__())
+    return JSONResponse(status_code=200, content=job)
@@ -1,224 +1,280 @@
 from datetime import datetime
 
-from fastapi import APIRouter, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, Depends
+from psycopg import AsyncConnection
 
-from connection import connection
-from utils.schemas import ErrorResponse, Error
+from utils.responses import JSONResponse
+from utils.schemas import ErrorResponse, Error, PullRequestCreate
 from utils.properties import ErrorCodes, PullRequestStatus
-from utils.db_queries import select_query, change_data_query
-from variables import JSON_DATETIME_FORMAT
+from utils.db_queries import DatabaseSession, select_query, change_data_query, get_connection, \
+    get_read_only_connection
+from utils.cache import review_cache
+from utils.reviewer_selection import TeamLoadQueue, pick_reviewers, update_reviewers_load
 
 router = APIRouter()
 
+# hot path queries, tests/test_indexes.py checks that their plans use the indexes
+PULL_REQUESTS_BY_ID_QUERY = '''
+                            SELECT pull_request_id, pull_request_name, author_id, status, created_at, merged_at
+                            FROM pull_request WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                            UNION ALL
+                            SELECT pull_request_id, pull_request_name, author_id, status, created_at, merged_at
+                            FROM pull_request_archive WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                            '''
+
 
 @router.post("/create")
 async def create_pull_request(pull_request_id: str = Body(...), pull_request_name: str = Body(...),
-                        author_id: str = Body(...)):
+                              author_id: str = Body(...),
+                              connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
     # we can't create a user with non-existing team, that's why we only need to check for user to exist
-    if select_query('SELECT user_id FROM "user" WHERE user_id = %(author_id)s',
-                    {'author_id': author_id}, return_one=True) is None:
+    author = await select_query(connection, 'SELECT user_id, team_name FROM "user" WHERE user_id = %(author_id)s',
+                                {'author_id': author_id}, return_one=True, prepare=True)
+    if author is None:
         return JSONResponse(status_code=404, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_FOUND, message='user_id not found'
         )).__dict__())
 
-    # check if pull request with the same pull_request_is already exists
-    if select_query('SELECT pull_request_id FROM pull_request WHERE pull_request_id = %(pull_request_id)s',
-                    {'pull_request_id': pull_request_id}) is not None:
+    # check if pull request with the same pull_request_is already exists, archived ones included
+    if await select_query(connection, '''
+                          SELECT pull_request_id FROM pull_request WHERE pull_request_id = %(pull_request_id)s
+                          UNION ALL
+                          SELECT pull_request_id FROM pull_request_archive WHERE pull_request_id = %(pull_request_id)s
+                          ''', {'pull_request_id': pull_request_id}, prepare=True) is not None:
         return JSONResponse(status_code=409, content=ErrorResponse(Error(
             code=ErrorCodes.PR_EXISTS, message='PR id already exists'
         )).__dict__())
 
+    # assign from 0 to 2 least loaded active team users as reviewers
+    assigned_reviewers = await pick_reviewers(connection, author['team_name'], 2, [author_id])
+
     current_datetime = datetime.now()
     # create pull_request
-    if change_data_query('''
-                         INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at)
-                         VALUES (%(pull_request_id)s, %(pull_request_name)s, %(author_id)s, %(status)s, %(created_at)s)
+    if not await change_data_query(connection, '''
+                         INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at,
+                                                   reviewers_amount)
+                         VALUES (%(pull_request_id)s, %(pull_request_name)s, %(author_id)s, %(status)s, %(created_at)s,
+                                 %(reviewers_amount)s)
                          ''', {'pull_request_id': pull_request_id, 'pull_request_name': pull_request_name,
-                               'author_id': author_id, 'status': PullRequestStatus.OPEN.value,
-                               'created_at': current_datetime}):
-        connection.commit()
-    else:
-        connection.rollback()
+                               'author_id': author_id, 'status': PullRequestStatus.OPEN.name,
+                               'created_at': current_datetime, 'reviewers_amount': len(assigned_reviewers)},
+                         prepare=True):
+        await connection.rollback()
         return JSONResponse(status_code=500, content=ErrorResponse(Error(
             code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to create pull request')).__dict__())
 
-    assigned_reviewers = []
-    # assign from 0 to 2 reviewers to pull request
-    # firstly, check what team users are active
-    active_team_users = select_query('''
-                                     SELECT user_id FROM "user"
-                                     WHERE team_name = (SELECT team_name FROM "user"
-                                                        WHERE user_id = %(author_id)s
-                                                        LIMIT 1) AND
-                                         user_id <> %(author_id)s AND
-                                         is_active = TRUE
-                                     ''', {'author_id': author_id})
-    if active_team_users is not None:
-        # gather 2 or less user_ids in an array
-        assigned_reviewers = list(map(lambda user: user['user_id'], active_team_users[:2]))
-
     # assign reviewers to created pull_request
     for reviewer in assigned_reviewers:
-        if change_data_query('''
+        if not await change_data_query(connection, '''
             INSERT INTO "assignment" (pull_request_id, reviewer_id)
             VALUES (%(pull_request_id)s, %(reviewer_id)s)
-        ''', {'pull_request_id': pull_request_id, 'reviewer_id': reviewer}):
-            connection.commit()
-        else:
-            connection.rollback()
+        ''', {'pull_request_id': pull_request_id, 'reviewer_id': reviewer}, prepare=True):
+            await connection.rollback()
             return JSONResponse(status_code=500, content=ErrorResponse(Error(
                 code=ErrorCodes.SERVER_ERROR,
                 message='Internal Server Error, unable to assign reviewer pull request')).__dict__())
+    await update_reviewers_load(connection, {reviewer: 1 for reviewer in assigned_reviewers})
+    # pull request and its reviewers are saved together
+    await connection.commit()
+    review_cache.invalidate(assigned_reviewers)
 
     # if everything was OK, return pull request data in response
     return JSONResponse(status_code=200, content={
         'pr':
             {'pull_request_id': pull_request_id, 'pull_request_name': pull_request_name, 'author_id': author_id,
              'status': PullRequestStatus.OPEN.name, 'assigned_reviewers': assigned_reviewers,
-             'createdAt': current_datetime.strftime(JSON_DATETIME_FORMAT),
+             'createdAt': current_datetime,
              'mergedAt': None}
     })
 
 
+# create many pull requests at once, authors, existing ids and team rosters are checked for the whole batch
+# and all pull requests with their reviewers are saved with multi-row statements in one transaction
+@router.post("/createMany")
+async def create_pull_requests(pull_requests: list[PullRequestCreate] = Body(..., embed=True),
+                               connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    authors = await select_query(connection, '''
+                                 SELECT user_id, team_name FROM "user" WHERE user_id = ANY(%(author_ids)s)
+                                 ''', {'author_ids': list({pr.author_id for pr in pull_requests})})
+    author_teams = {author['user_id']: author['team_name'] for author in authors or []}
+    existing_pull_requests = await select_query(connection, '''
+                                                SELECT pull_request_id FROM pull_request
+                                                WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                                                UNION ALL
+                                                SELECT pull_request_id FROM pull_request_archive
+                                                WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                                                ''', {'pull_request_ids': [pr.pull_request_id for pr in pull_requests]})
+    taken_ids = {pr['pull_request_id'] for pr in existing_pull_requests or []}
+
+    # team rosters are loaded once per team and reviewers are spread over team members by their load
+    team_load_queue = await TeamLoadQueue.load(connection, list(set(author_teams.values())))
+    current_datetime = datetime.now()
+    results = []
+    created = {}
+    for pr in pull_requests:
+        if pr.author_id not in author_teams:
+            results.append({'pull_request_id': pr.pull_request_id, 'status': 404, 'error': ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='user_id not found'
+            )).__dict__()})
+            continue
+        if pr.pull_request_id in taken_ids:
+            results.append({'pull_request_id': pr.pull_request_id, 'status': 409, 'error': ErrorResponse(Error(
+                code=ErrorCodes.PR_EXISTS, message='PR id already exists'
+            )).__dict__()})
+            continue
+        taken_ids.add(pr.pull_request_id)
+        created[pr.pull_request_id] = {
+            'pull_request_id': pr.pull_request_id, 'pull_request_name': pr.pull_request_name,
+            'author_id': pr.author_id, 'status': PullRequestStatus.OPEN.name,
+            'assigned_reviewers': team_load_queue.pick(author_teams[pr.author_id], 2, {pr.author_id}),
+            'createdAt': current_datetime, 'mergedAt': None
+        }
+        results.append({'pull_request_id': pr.pull_request_id, 'status': 200, 'pr': created[pr.pull_request_id]})
+
+    if created:
+        prs = list(created.values())
+        if not await change_data_query(connection, '''
+                INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at,
+                                          reviewers_amount)
+                SELECT pull_request_id, pull_request_name, author_id, %(status)s, %(created_at)s, reviewers_amount
+                FROM unnest(%(pull_request_ids)s::text[], %(pull_request_names)s::text[], %(author_ids)s::text[],
+                            %(reviewers_amounts)s::integer[])
+                    AS p(pull_request_id, pull_request_name, author_id, reviewers_amount)
+                ''', {'status': PullRequestStatus.OPEN.name, 'created_at': current_datetime,
+                      'pull_request_ids': [pr['pull_request_id'] for pr in prs],
+                      'pull_request_names': [pr['pull_request_name'] for pr in prs],
+                      'author_ids': [pr['author_id'] for pr in prs],
+                      'reviewers_amounts': [len(pr['assigned_reviewers']) for pr in prs]}):
+            await connection.rollback()
+            return JSONResponse(status_code=500, content=ErrorResponse(Error(
+                code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to create pull requests'
+            )).__dict__())
+
+        assignments = [(pr['pull_request_id'], reviewer) for pr in prs for reviewer in pr['assigned_reviewers']]
+        if assignments:
+            pull_request_ids, reviewer_ids = map(list, zip(*assignments))
+            if not await change_data_query(connection, '''
+                    INSERT INTO "assignment" (pull_request_id, reviewer_id)
+                    SELECT * FROM unnest(%(pull_request_ids)s::text[], %(reviewer_ids)s::text[])
+                    ''', {'pull_request_ids': pull_request_ids, 'reviewer_ids': reviewer_ids}):
+                await connection.rollback()
+                return JSONResponse(status_code=500, content=ErrorResponse(Error(
+                    code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to assign reviewers'
+                )).__dict__())
+            await update_reviewers_load(connection, team_load_queue.load_changes)
+        await connection.commit()
+        review_cache.invalidate(team_load_queue.load_changes.keys())
+
+    return JSONResponse(status_code=200, content={'results': results})
+
+
 @router.post("/merge")
-async def merge_pull_request(pull_request_id: str = Body(..., embed=True)):
-    pull_request_info = select_query('''
-                                     SELECT pull_request_id, pull_request_name, author_id, created_at FROM pull_request
-                                     WHERE pull_request_id = %(pull_request_id)s
-                                     ''', {'pull_request_id': pull_request_id}, return_one=True)
+async def merge_pull_request(pull_request_id: str = Body(..., embed=True),
+                             connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # status change, reviewers load update and reading of the result are done by one function call,
+    # see migrations/0005_pull_request_functions.sql and 0009_ordered_user_locks.sql
+    merged = await select_query(connection, '''
+                                SELECT * FROM merge_pull_request(%(pull_request_id)s, %(merged_at)s)
+                                ''', {'pull_request_id': pull_request_id, 'merged_at': datetime.now()},
+                                return_one=True, prepare=True)
+    await connection.commit()
     # return 404 if pull request doesn't exist
-    if pull_request_info is None:
+    if merged['result'] == ErrorCodes.NOT_FOUND.value:
         return JSONResponse(status_code=404, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_FOUND, message='pull_request_id not found'
         )).__dict__())
-
-    current_datetime = datetime.now()
-    # change pull request status to merged and add mergedAt value
-    if change_data_query('''
-        UPDATE pull_request SET status = %(status)s, merged_at = %(merged_at)s
-        WHERE pull_request_id = %(pull_request_id)s
-    ''', {'pull_request_id': pull_request_id, 'status': PullRequestStatus.MERGED.name,
-          'merged_at': current_datetime.strftime(JSON_DATETIME_FORMAT)}):
-        connection.commit()
-    else:
-        connection.rollback()
-        return JSONResponse(status_code=500, content=ErrorResponse(Error(
-            code=ErrorCodes.SERVER_ERROR,
-            message='Internal Server Error, unable to change pull request status')).__dict__())
-
-    # get reviewers assigned to pull request
-    assigned_reviewers = select_query('''
-                                      SELECT reviewer_id FROM "assignment"
-                                      WHERE pull_request_id = %(pull_request_id)s
-                                      ''', {'pull_request_id': pull_request_id})
-    if assigned_reviewers is None:
-        assigned_reviewers = []
-    else:
-        assigned_reviewers = list(map(lambda reviewer: reviewer['reviewer_id'], assigned_reviewers))
+    review_cache.invalidate(merged['assigned_reviewers'])
 
     return JSONResponse(status_code=200, content={'pr': {
-        'pull_request_id': pull_request_id, 'pull_request_name': pull_request_info['pull_request_name'],
-        'author_id': pull_request_info['author_id'], 'status': PullRequestStatus.MERGED.name,
-        'assigned_reviewers': assigned_reviewers,
-        'createdAt': pull_request_info['created_at'].strftime(JSON_DATETIME_FORMAT),
-        'mergedAt': current_datetime.strftime(JSON_DATETIME_FORMAT)
+        'pull_request_id': pull_request_id, 'pull_request_name': merged['pull_request_name'],
+        'author_id': merged['author_id'], 'status': PullRequestStatus.MERGED.name,
+        'assigned_reviewers': merged['assigned_reviewers'],
+        'createdAt': merged['created_at'],
+        'mergedAt': merged['merged_at']
     }})
 
 
 @router.post("/reassign")
-async def reassign_pull_request(pull_request_id: str = Body(...), old_user_id: str = Body(...)):
+async def reassign_pull_request(pull_request_id: str = Body(...), old_user_id: str = Body(...),
+                                connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # all checks, choice of the least loaded candidate and the replacement are done atomically by one function call,
+    # see migrations/0005_pull_request_functions.sql and 0009_ordered_user_locks.sql
+    reassigned = await select_query(connection, '''
+                                    SELECT * FROM reassign_pull_request(%(pull_request_id)s, %(old_user_id)s)
+                                    ''', {'pull_request_id': pull_request_id, 'old_user_id': old_user_id},
+                                    return_one=True, prepare=True)
+    await connection.commit()
+
     # check if pull request and user exist
-    if select_query('SELECT pull_request_id FROM pull_request WHERE pull_request_id = %(pull_request_id)s',
-                    {'pull_request_id': pull_request_id}, return_one=True) is None or \
-        select_query('SELECT user_id FROM "user" WHERE user_id = %(old_user_id)s',
-                     {'old_user_id': old_user_id}, return_one=True) is None:
+    if reassigned['result'] == ErrorCodes.NOT_FOUND.value:
         return JSONResponse(status_code=404, content=ErrorResponse(Error(
             ErrorCodes.NOT_FOUND, message='pull_request_id or user_id not found')).__dict__())
-
     # check if pull request is already merged
-    if select_query('SELECT status FROM pull_request WHERE pull_request_id = %(pull_request_id)s',
-                    {'pull_request_id': pull_request_id},
-                    return_one=True)['status'] == PullRequestStatus.MERGED.name:
+    if reassigned['result'] == ErrorCodes.PR_MERGED.value:
         return JSONResponse(status_code=409, content=ErrorResponse(Error(
             code=ErrorCodes.PR_MERGED, message='cannot reassign on merged PR'
         )).__dict__())
-
     # check if user assign as a reviewer for this pull request
-    if select_query('''
-                    SELECT * FROM "assignment"
-                    WHERE pull_request_id = %(pull_request_id)s AND reviewer_id = %(old_user_id)s
-                    ''', {'pull_request_id': pull_request_id, 'old_user_id': old_user_id},
-                    return_one=True) is None:
+    if reassigned['result'] == ErrorCodes.NOT_ASSIGNED.value:
         return JSONResponse(status_code=409, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_ASSIGNED, message='reviewer is not assigned to this PR'
         )).__dict__())
-
     # check if we have another active reviewer in team to assign pull request
-    reassign_candidate = select_query('''
-        SELECT user_id FROM "user"
-        WHERE team_name = (SELECT team_name FROM "user" WHERE user_id = %(old_user_id)s LIMIT 1) AND
-            user_id NOT IN (SELECT reviewer_id FROM "assignment" WHERE pull_request_id = %(pull_request_id)s) AND
-            user_id <> (SELECT author_id FROM pull_request WHERE pull_request_id = %(pull_request_id)s LIMIT 1) AND
-            is_active = True
-        ''', {'pull_request_id': pull_request_id, 'old_user_id': old_user_id}, return_one=True)
-    if reassign_candidate is None:
+    if reassigned['result'] == ErrorCodes.NO_CANDIDATE.value:
         return JSONResponse(status_code=409, content=ErrorResponse(Error(
             code=ErrorCodes.NO_CANDIDATE, message='no active replacement in team'
         )).__dict__())
-
-    # delete old assignment and create new assignment
-    if change_data_query('''
-                         DELETE FROM "assignment"
-                         WHERE pull_request_id = %(pull_request_id)s AND reviewer_id = %(old_user_id)s
-                         ''', {'pull_request_id': pull_request_id, 'old_user_id': old_user_id}):
-        connection.commit()
-    else:
-        connection.rollback()
-        return JSONResponse(status_code=500, content=ErrorResponse(Error(
-            code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to unassign reviewer from pull request'
-        )).__dict__())
-
-    if change_data_query('''
-                         INSERT INTO "assignment" (pull_request_id, reviewer_id)
-                         VALUES (%(pull_request_id)s, %(reassign_candidate)s)
-                         ''', {'pull_request_id': pull_request_id, 'reassign_candidate': reassign_candidate['user_id']}):
-        connection.commit()
-    else:
-        connection.rollback()
-        return JSONResponse(status_code=500, content=ErrorResponse(Error(
-            code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to assign new reviewer from pull request'
-        )).__dict__())
-
-    # get pull request and reviewers data
-    pull_request_info = select_query('''
-                                     SELECT pull_request_name, author_id, status, created_at, merged_at
-                                     FROM pull_request
-                                     WHERE pull_request_id = %(pull_request_id)s
-                                     ''', {'pull_request_id': pull_request_id}, return_one=True)
-    if pull_request_info is None:
-        return JSONResponse(status_code=500, content=ErrorResponse(Error(
-            code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to get pull request information'
-        )).__dict__())
-
-    assigned_reviewers = select_query('''
-                                      SELECT reviewer_id FROM "assignment"
-                                      WHERE pull_request_id = %(pull_request_id)s
-                                      ''', {'pull_request_id': pull_request_id})
-    if assigned_reviewers is None:
-        return JSONResponse(status_code=500, content=ErrorResponse(Error(
-            code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to get reviewers assigned to pull request'
-        )).__dict__())
-    assigned_reviewers = list(map(lambda reviewer: reviewer['reviewer_id'], assigned_reviewers))
+    review_cache.invalidate([old_user_id, reassigned['replaced_by']])
 
     return JSONResponse(status_code=200, content={
         'pr': {
             'pull_request_id': pull_request_id,
-            'pull_request_name': pull_request_info['pull_request_name'],
-            'author_id': pull_request_info['author_id'],
-            'status': pull_request_info['status'],
-            'assigned_reviewers': assigned_reviewers,
-            'createdAt': pull_request_info['created_at'].strftime(JSON_DATETIME_FORMAT),
-            'mergedAt': pull_request_info['merged_at'].strftime(JSON_DATETIME_FORMAT) if pull_request_info['merged_at'] is not None else None,
+            'pull_request_name': reassigned['pull_request_name'],
+            'author_id': reassigned['author_id'],
+            'status': reassigned['status'],
+            'assigned_reviewers': reassigned['assigned_reviewers'],
+            'createdAt': reassigned['created_at'],
+            'mergedAt': None,
         },
-        'replaced_by': reassign_candidate['user_id']})
+        'replaced_by': reassigned['replaced_by']})
+
+
+# pull requests by id in the shape of /pullRequest/merge responses, archived ones included:
+# one query for pull requests and one for their reviewers, results are in the order of the request.
+# it's a POST because of the ids in the body, but only reads, so it's served by the replica if it's set
+@router.post("/getMany")
+async def get_pull_requests(pull_request_ids: list[str] = Body(..., embed=True),
+                            connection: DatabaseSession | AsyncConnection = Depends(get_read_only_connection)):
+    # remove duplicates but keep order of pull requests in request
+    pull_request_ids = list(dict.fromkeys(pull_request_ids))
+
+    found = await select_query(connection, PULL_REQUESTS_BY_ID_QUERY, {'pull_request_ids': pull_request_ids},
+                               prepare=True)
+    pull_requests = {pr['pull_request_id']: {
+        'pull_request_id': pr['pull_request_id'], 'pull_request_name': pr['pull_request_name'],
+        'author_id': pr['author_id'], 'status': pr['status'], 'assigned_reviewers': [],
+        'createdAt': pr['created_at'], 'mergedAt': pr['merged_at']
+    } for pr in found or []}
+
+    if pull_requests:
+        assignments = await select_query(connection, '''
+                                         SELECT pull_request_id, reviewer_id FROM "assignment"
+                                         WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                                         UNION ALL
+                                         SELECT pull_request_id, reviewer_id FROM assignment_archive
+                                         WHERE pull_request_id = ANY(%(pull_request_ids)s)
+                                         ORDER BY reviewer_id
+                                         ''', {'pull_request_ids': list(pull_requests)}, prepare=True)
+        for assignment in assignments or []:
+            pull_requests[assignment['pull_request_id']]['assigned_reviewers'].append(assignment['reviewer_id'])
+
+    results = []
+    for pull_request_id in pull_request_ids:
+        if pull_request_id in pull_requests:
+            results.append({'pull_request_id': pull_request_id, 'status': 200,
+                            'pr': pull_requests[pull_request_id]})
+        else:
+            results.append({'pull_request_id': pull_request_id, 'status': 404, 'error': ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='pull_request_id not found'
+            )).__dict__()})
+    return JSONResponse(status_code=200, content={'results': results})
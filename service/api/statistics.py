@@ -1,37 +1,245 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from datetime import date, datetime, timedelta
 
+from fastapi import APIRouter, Depends, Query
+from psycopg import AsyncConnection
+
+from utils.responses import JSONResponse
 from utils.schemas import ErrorResponse, Error
 from utils.properties import ErrorCodes
-from utils.db_queries import select_query
+from utils.db_queries import DatabaseSession, select_query, get_connection
+from utils.cache import team_cache, review_cache, statistics_cache, coalesced
+from utils.pagination import PAGE_LIMIT_MAX, select_page, ndjson_response
+from utils.rollups import merge_time_summary, merge_time_summaries
 
 
 router = APIRouter()
 
+# the longest date range of /throughput, in days
+THROUGHPUT_MAX_DAYS = 366
+
+# merged pull requests moved to the archive (migrations/0007_pull_request_archive.sql) are counted as well
+PULL_REQUESTS_EXIST_QUERY = '''
+                            SELECT EXISTS (SELECT 1 FROM pull_request) OR
+                                EXISTS (SELECT 1 FROM pull_request_archive) AS pull_requests_exist
+                            '''
+
+# hot path queries, tests/test_indexes.py checks that their plans use the indexes
+TEAM_REVIEWER_LOAD_QUERY = '''
+                           SELECT user_id, team_name, is_active, open_reviews FROM "user"
+                           WHERE team_name = %(team_name)s AND (%(after)s::text IS NULL OR user_id > %(after)s)
+                           ORDER BY user_id
+                           LIMIT %(limit)s
+                           '''
+
 
 # count reviewers amount on requested pull requests or on all pull requests if pull_request_id is None
 @router.get("/pull_request_reviewers_amount")
-async def pull_request_viewers_amount(pull_request_id: str | None = None):
-    # check if pull_request exists or any pull_request_id exists
-    if pull_request_id is not None and select_query('''
-                                                    SELECT pull_request_id FROM pull_request
-                                                    WHERE pull_request_id = %(pull_request_id)s
-                                                    ''', {'pull_request_id': pull_request_id},
-                                                    return_one=True) is None or \
-            pull_request_id is None and select_query('SELECT * FROM pull_request') is None:
-        return JSONResponse(status_code=404, content=ErrorResponse(Error(
-            code=ErrorCodes.NOT_FOUND, message='pull request not found'
-        )).__dict__())
+@coalesced(statistics_cache, skip=lambda parameters: parameters['stream'])
+async def pull_request_viewers_amount(pull_request_id: str | None = None,
+                                      limit: int | None = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+                                      cursor: str | None = None, stream: bool = False,
+                                      connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # keyset paginated or streamed (NDJSON) reviewers amount of all pull requests
+    if pull_request_id is None and (limit is not None or cursor is not None or stream):
+        if not (await select_query(connection, PULL_REQUESTS_EXIST_QUERY, return_one=True))['pull_requests_exist']:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='pull request not found'
+            )).__dict__())
+        query = '''
+                SELECT pull_request_id, reviewers_amount FROM (
+                    SELECT pull_request_id, reviewers_amount FROM pull_request
+                    UNION ALL
+                    SELECT pull_request_id, reviewers_amount FROM pull_request_archive
+                ) pr
+                WHERE reviewers_amount > 0 AND (%(after)s::text IS NULL OR pull_request_id > %(after)s)
+                ORDER BY pull_request_id
+                LIMIT %(limit)s
+                '''
+        if stream:
+            return ndjson_response(connection, query, {}, limit, cursor)
+        reviewers_amount, next_cursor = await select_page(connection, query, {}, 'pull_request_id',
+                                                          limit or PAGE_LIMIT_MAX, cursor)
+        return JSONResponse(status_code=200, content={
+            'reviewers_amount': {ra['pull_request_id']: ra['reviewers_amount'] for ra in reviewers_amount},
+            'next_cursor': next_cursor
+        })
 
-    # build query to get reviewers amount
-    query = 'SELECT pull_request_id, COUNT(reviewer_id) FROM "assignment"'
+    # reviewers amount is stored in pull_request table and is updated together with assignments,
+    # so counting is a plain read without aggregation over assignment table
     if pull_request_id is not None:
-        query += ' WHERE pull_request_id = %(pull_request_id)s\n'
-    query += ' GROUP BY pull_request_id'
-    reviewers_amount = select_query(query, {'pull_request_id': pull_request_id})
+        reviewers_amount = await select_query(connection, '''
+                                              SELECT pull_request_id, reviewers_amount FROM pull_request
+                                              WHERE pull_request_id = %(pull_request_id)s
+                                              UNION ALL
+                                              SELECT pull_request_id, reviewers_amount FROM pull_request_archive
+                                              WHERE pull_request_id = %(pull_request_id)s
+                                              ''', {'pull_request_id': pull_request_id})
+    else:
+        # pull requests without reviewers have no assignments, so they are not counted
+        reviewers_amount = await select_query(connection, '''
+                                              SELECT pull_request_id, reviewers_amount FROM pull_request
+                                              WHERE reviewers_amount > 0
+                                              UNION ALL
+                                              SELECT pull_request_id, reviewers_amount FROM pull_request_archive
+                                              WHERE reviewers_amount > 0
+                                              ''')
+
+    # check if pull_request exists or any pull_request_id exists
+    if reviewers_amount is None:
+        if pull_request_id is not None or not (await select_query(
+                connection, PULL_REQUESTS_EXIST_QUERY, return_one=True))['pull_requests_exist']:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='pull request not found'
+            )).__dict__())
+        reviewers_amount = []
 
     response = {}
     for ra in reviewers_amount:
-        response[ra['pull_request_id']] = ra['count']
+        response[ra['pull_request_id']] = ra['reviewers_amount']
 
     return JSONResponse(status_code=200, content={'reviewers_amount': response})
+
+
+# hit, miss and coalesced requests counters of team rosters, review queues and statistics caches, used to size them
+@router.get("/cache")
+async def cache_statistics():
+    return JSONResponse(status_code=200, content={cache.name: cache.stats() for cache in (team_cache, review_cache,
+                                                                                      statistics_cache)})
+
+
+# statistics below are read from rollup tables (migrations/0006_review_rollups.sql) and counters
+# which are updated together with pull requests, their cost doesn't depend on the amount of pull requests
+
+async def team_exists(connection: DatabaseSession | AsyncConnection, team_name: str) -> bool:
+    return await select_query(connection, 'SELECT team_name FROM team WHERE team_name = %(team_name)s',
+                              {'team_name': team_name}, prepare=True) is not None
+
+
+# time from creation to merge percentiles of one team or of all teams
+@router.get("/team_time_to_merge")
+@coalesced(statistics_cache)
+async def team_time_to_merge(team_name: str | None = None,
+                             connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    if team_name is None:
+        histograms = await select_query(connection, '''
+                                        SELECT team_name, bucket, pull_requests, seconds_sum FROM team_merge_time
+                                        ''', prepare=True)
+        summaries = merge_time_summaries(histograms or [], 'team_name')
+        return JSONResponse(status_code=200, content={'teams': [
+            {'team_name': name, **summary} for name, summary in sorted(summaries.items())
+        ]})
+
+    histograms = await select_query(connection, '''
+                                    SELECT bucket, pull_requests, seconds_sum FROM team_merge_time
+                                    WHERE team_name = %(team_name)s
+                                    ''', {'team_name': team_name}, prepare=True)
+    if histograms is None and not await team_exists(connection, team_name):
+        return JSONResponse(status_code=404, content=ErrorResponse(Error(
+            code=ErrorCodes.NOT_FOUND, message='team_name not found'
+        )).__dict__())
+    return JSONResponse(status_code=200, content={'team_name': team_name, **merge_time_summary(histograms or [])})
+
+
+# time from creation to merge percentiles of one author or of every author of a team
+@router.get("/author_time_to_merge")
+@coalesced(statistics_cache)
+async def author_time_to_merge(author_id: str | None = None, team_name: str | None = None,
+                               connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    if author_id is not None:
+        histograms = await select_query(connection, '''
+                                        SELECT bucket, pull_requests, seconds_sum FROM author_merge_time
+                                        WHERE author_id = %(author_id)s
+                                        ''', {'author_id': author_id}, prepare=True)
+        if histograms is None and await select_query(connection,
+                                                     'SELECT user_id FROM "user" WHERE user_id = %(user_id)s',
+                                                     {'user_id': author_id}) is None:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='author_id not found'
+            )).__dict__())
+        # an author who changed teams has histograms in each of them, they are summarized together
+        return JSONResponse(status_code=200, content={'author_id': author_id,
+                                                      **merge_time_summary(histograms or [])})
+
+    if team_name is not None:
+        histograms = await select_query(connection, '''
+                                        SELECT author_id, bucket, pull_requests, seconds_sum FROM author_merge_time
+                                        WHERE team_name = %(team_name)s
+                                        ''', {'team_name': team_name}, prepare=True)
+        if histograms is None and not await team_exists(connection, team_name):
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='team_name not found'
+            )).__dict__())
+        summaries = merge_time_summaries(histograms or [], 'author_id')
+        return JSONResponse(status_code=200, content={'team_name': team_name, 'authors': [
+            {'author_id': name, **summary} for name, summary in sorted(summaries.items())
+        ]})
+
+    return JSONResponse(status_code=400, content=ErrorResponse(Error(
+        code=ErrorCodes.BAD_REQUEST, message='author_id or team_name is required'
+    )).__dict__())
+
+
+# open reviews of every user (of a team), keyset paginated by user_id
+@router.get("/reviewer_load")
+@coalesced(statistics_cache)
+async def reviewer_load(team_name: str | None = None, limit: int | None = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+                        cursor: str | None = None,
+                        connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    if team_name is None:
+        query = '''
+                SELECT user_id, team_name, is_active, open_reviews FROM "user"
+                WHERE %(after)s::text IS NULL OR user_id > %(after)s
+                ORDER BY user_id
+                LIMIT %(limit)s
+                '''
+    else:
+        query = TEAM_REVIEWER_LOAD_QUERY
+    reviewers, next_cursor = await select_page(connection, query, {'team_name': team_name}, 'user_id',
+                                               limit or PAGE_LIMIT_MAX, cursor)
+    if not reviewers and cursor is None and team_name is not None:
+        return JSONResponse(status_code=404, content=ErrorResponse(Error(
+            code=ErrorCodes.NOT_FOUND, message='team_name not found'
+        )).__dict__())
+    return JSONResponse(status_code=200, content={'reviewers': reviewers, 'next_cursor': next_cursor})
+
+
+# created and merged pull requests per day (of a team), the last 30 days by default
+@router.get("/throughput")
+@coalesced(statistics_cache)
+async def throughput(team_name: str | None = None, date_from: date | None = None, date_to: date | None = None,
+                     connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    date_to = date_to or datetime.now().date()
+    date_from = date_from or date_to - timedelta(days=29)
+    if date_from > date_to or (date_to - date_from).days >= THROUGHPUT_MAX_DAYS:
+        return JSONResponse(status_code=400, content=ErrorResponse(Error(
+            code=ErrorCodes.BAD_REQUEST,
+            message=f'date_from must not be later than date_to, the range must not exceed {THROUGHPUT_MAX_DAYS} days'
+        )).__dict__())
+
+    if team_name is None:
+        days = await select_query(connection, '''
+                                  SELECT day, SUM(created)::BIGINT AS created, SUM(merged)::BIGINT AS merged
+                                  FROM daily_throughput
+                                  WHERE day BETWEEN %(date_from)s AND %(date_to)s
+                                  GROUP BY day
+                                  ''', {'date_from': date_from, 'date_to': date_to}, prepare=True)
+    else:
+        days = await select_query(connection, '''
+                                  SELECT day, created, merged FROM daily_throughput
+                                  WHERE team_name = %(team_name)s AND day BETWEEN %(date_from)s AND %(date_to)s
+                                  ''', {'team_name': team_name, 'date_from': date_from, 'date_to': date_to},
+                                  prepare=True)
+        if days is None and not await team_exists(connection, team_name):
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='team_name not found'
+            )).__dict__())
+
+    # days without pull requests are returned with zeros, so the series has no gaps
+    days = {row['day']: row for row in days or []}
+    series = []
+    for offset in range((date_to - date_from).days + 1):
+        day = date_from + timedelta(days=offset)
+        series.append({'day': day, 'created': days[day]['created'] if day in days else 0,
+                       'merged': days[day]['merged'] if day in days else 0})
+    return JSONResponse(status_code=200, content={'team_name': team_name, 'date_from': date_from,
+                                                  'date_to': date_to, 'days': series})
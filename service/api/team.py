@@ -1,37 +1,57 @@
 from dataclasses import asdict
+from typing import AsyncIterator
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi import APIRouter, Body, Depends, Query, Request
+from psycopg import AsyncConnection
+from psycopg.rows import class_row
+from pydantic import TypeAdapter, ValidationError
 
-from connection import connection
-from utils.schemas import ErrorResponse, Error, Team
+from utils.responses import JSONResponse
+from utils.schemas import ErrorResponse, Error, Team, TeamMember
 from utils.properties import ErrorCodes
-from utils.db_queries import select_query, change_data_query
+from utils.db_queries import DatabaseSession, select_query, change_data_query, get_connection
+from utils.cache import team_cache, review_cache
+from utils.pagination import PAGE_LIMIT_MAX, select_page, ndjson_response
+from utils.reviewer_selection import plan_rebalance, apply_replacements
 
 
 router = APIRouter()
 
+# hot path queries, tests/test_indexes.py checks that their plans use the indexes
+TEAM_PAGE_QUERY = '''
+                  SELECT user_id, username, is_active FROM "user"
+                  WHERE team_name = %(team_name)s AND (%(after)s::text IS NULL OR user_id > %(after)s)
+                  ORDER BY user_id
+                  LIMIT %(limit)s
+                  '''
+
 
 @router.post("/add")
-async def add_team(team: Team):
+async def add_team(team: Team, connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
     # check if team already exists in DB
-    if select_query("SELECT * FROM team WHERE team_name = %(team_name)s",
-                    {'team_name': team.team_name}, return_one=True) is not None:
+    if await select_query(connection, "SELECT * FROM team WHERE team_name = %(team_name)s",
+                          {'team_name': team.team_name}, return_one=True) is not None:
         return JSONResponse(status_code=400, content=ErrorResponse(Error(
             code=ErrorCodes.TEAM_EXISTS, message="team_name already exists")
         ).__dict__())
 
     # if insert operation failed, return internal server error
-    if not change_data_query("INSERT INTO team(team_name) VALUES (%(team_name)s)",
+    if not await change_data_query(connection, "INSERT INTO team(team_name) VALUES (%(team_name)s)",
                     {'team_name': team.team_name}):
-        connection.rollback()
+        await connection.rollback()
         return JSONResponse(status_code=500, content=ErrorResponse(Error(
             code=ErrorCodes.SERVER_ERROR, message="Internal Server Error, unable to add team")
         ).__dict__())
 
+    # members moved from other teams change rosters of those teams too
+    previous_teams = await select_query(connection, '''
+                                        SELECT DISTINCT team_name FROM "user" WHERE user_id = ANY(%(user_ids)s)
+                                        ''', {'user_ids': [member.user_id for member in team.members]})
+
     # add team members to user table if they don't exist or update their properties if users with same user_ids exist
     for member in team.members:
-        if not change_data_query('''
+        if not await change_data_query(connection, '''
             INSERT INTO "user" (user_id, username, team_name, is_active) 
             VALUES (%(user_id)s, %(username)s, %(team_name)s, %(is_active)s)
             ON CONFLICT (user_id) DO UPDATE SET 
@@ -39,27 +59,220 @@ async def add_team(team: Team):
                 team_name = %(team_name)s,
                 is_active = %(is_active)s
         ''', {**asdict(member), 'team_name': team.team_name}):
-            connection.rollback()
+            await connection.rollback()
             return JSONResponse(status_code=500, content=ErrorResponse(Error(
                 code=ErrorCodes.SERVER_ERROR, message="Internal Server Error, unable to add or update user")
             ).__dict__())
 
-    connection.commit()
+    await connection.commit()
+    team_cache.invalidate([team.team_name, *(previous_team['team_name'] for previous_team in previous_teams or [])])
     return JSONResponse(status_code=201, content=asdict(team))
 
 
+# amount of teams saved with one multi-row statement
+TEAM_IMPORT_BATCH_SIZE = 1000
+
+team_adapter = TypeAdapter(Team)
+
+
+# body is a JSON array of teams or NDJSON stream (one team per line) if content type is application/x-ndjson,
+# NDJSON is parsed while it's being received
+async def read_json_items(request: Request) -> AsyncIterator:
+    if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+        buffer = b''
+        async for chunk in request.stream():
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield orjson.loads(line)
+        if buffer.strip():
+            yield orjson.loads(buffer)
+    else:
+        items = orjson.loads(await request.body())
+        if not isinstance(items, list):
+            raise ValueError('JSON array of teams is expected')
+        for item in items:
+            yield item
+
+
+# save teams and their members with two statements, teams that already exist are skipped with TEAM_EXISTS error
+async def import_team_batch(connection: DatabaseSession | AsyncConnection, teams: list[Team],
+                            imported_team_names: set[str], changed_team_names: set[str]) -> list:
+    new_team_names = list(dict.fromkeys(team.team_name for team in teams if team.team_name not in imported_team_names))
+    created_teams = await select_query(connection, '''
+                                       INSERT INTO team (team_name)
+                                       SELECT unnest(%(team_names)s::text[])
+                                       ON CONFLICT (team_name) DO NOTHING
+                                       RETURNING team_name
+                                       ''', {'team_names': new_team_names})
+    created_team_names = {team['team_name'] for team in created_teams or []}
+    imported_team_names.update(new_team_names)
+
+    # only the first occurrence of a created team name is added, later ones are rejected as existing teams
+    # together with their members
+    accepted_teams = []
+    for team in teams:
+        if team.team_name in created_team_names:
+            created_team_names.remove(team.team_name)
+            accepted_teams.append(team)
+    accepted_team_ids = {id(team) for team in accepted_teams}
+
+    # the same user can't be updated twice by one statement, so the last team the user is listed in wins,
+    # as if teams were added one by one
+    members = {}
+    for team in accepted_teams:
+        for member in team.members:
+            members.pop(member.user_id, None)
+            members[member.user_id] = (member.username, team.team_name, member.is_active)
+    if members:
+        # members moved from other teams change rosters of those teams too
+        previous_teams = await select_query(connection, '''
+                                            SELECT DISTINCT team_name FROM "user" WHERE user_id = ANY(%(user_ids)s)
+                                            ''', {'user_ids': list(members.keys())})
+        changed_team_names.update(previous_team['team_name'] for previous_team in previous_teams or [])
+        usernames, team_names, is_active = map(list, zip(*members.values()))
+        await change_data_query(connection, '''
+                                INSERT INTO "user" (user_id, username, team_name, is_active)
+                                SELECT * FROM unnest(%(user_ids)s::text[], %(usernames)s::text[],
+                                                     %(team_names)s::text[], %(is_active)s::boolean[])
+                                ON CONFLICT (user_id) DO UPDATE SET
+                                    username = EXCLUDED.username,
+                                    team_name = EXCLUDED.team_name,
+                                    is_active = EXCLUDED.is_active
+                                ''', {'user_ids': list(members.keys()), 'usernames': usernames,
+                                      'team_names': team_names, 'is_active': is_active})
+
+    changed_team_names.update(team.team_name for team in accepted_teams)
+    results = []
+    for team in teams:
+        if id(team) in accepted_team_ids:
+            results.append({'team_name': team.team_name, 'status': 201, 'team': asdict(team)})
+        else:
+            results.append({'team_name': team.team_name, 'status': 400, 'error': ErrorResponse(Error(
+                code=ErrorCodes.TEAM_EXISTS, message="team_name already exists")
+            ).__dict__()})
+    return results
+
+
+# add many teams at once, all teams are saved in one transaction with a few statements per TEAM_IMPORT_BATCH_SIZE teams
+@router.post("/import")
+async def import_teams(request: Request, connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    results = []
+    imported_team_names, changed_team_names = set(), set()
+    batch = []
+    try:
+        async for item in read_json_items(request):
+            batch.append(team_adapter.validate_python(item))
+            if len(batch) == TEAM_IMPORT_BATCH_SIZE:
+                results += await import_team_batch(connection, batch, imported_team_names, changed_team_names)
+                batch = []
+        if batch:
+            results += await import_team_batch(connection, batch, imported_team_names, changed_team_names)
+    except (ValueError, ValidationError) as e:
+        await connection.rollback()
+        return JSONResponse(status_code=400, content=ErrorResponse(Error(
+            code=ErrorCodes.BAD_REQUEST, message=f"invalid teams data: {e}")
+        ).__dict__())
+
+    await connection.commit()
+    team_cache.invalidate(changed_team_names)
+    return JSONResponse(status_code=200, content={'results': results})
+
+
 @router.get("/get")
-async def get_team(team_name: str):
-    team_users = select_query('''
-                                   SELECT u.user_id, u.username, u.is_active
-                                   FROM team t
-                                   JOIN "user" u ON t.team_name = u.team_name
-                                   WHERE t.team_name = %(team_name)s
-                              ''', {'team_name': team_name})
-    if team_users is None:
+async def get_team(team_name: str, limit: int | None = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+                   cursor: str | None = None, stream: bool = False,
+                   connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # keyset paginated or streamed (NDJSON) members for large teams
+    if limit is not None or cursor is not None or stream:
+        if await select_query(connection, 'SELECT team_name FROM team WHERE team_name = %(team_name)s',
+                              {'team_name': team_name}, return_one=True) is None:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message="team_name not found")
+            ).__dict__())
+        query = TEAM_PAGE_QUERY
+        if stream:
+            return ndjson_response(connection, query, {'team_name': team_name}, limit, cursor)
+        team_users, next_cursor = await select_page(connection, query, {'team_name': team_name}, 'user_id',
+                                                    limit or PAGE_LIMIT_MAX, cursor)
+        return JSONResponse(status_code=200, content={'team_name': team_name, 'members': team_users,
+                                                      'next_cursor': next_cursor})
+
+    # rosters change rarely, they are cached until a write to the team or TTL expiration.
+    # they are read from the primary, rows of a lagging replica would stay in the cache
+    # concurrent misses of the same team share one query
+    async def load_team() -> dict | None:
+        team_users = await select_query(connection, '''
+                                       SELECT u.user_id, u.username, u.is_active
+                                       FROM team t
+                                       JOIN "user" u ON t.team_name = u.team_name
+                                       WHERE t.team_name = %(team_name)s
+                                  ''', {'team_name': team_name}, row_factory=class_row(TeamMember), prepare=True,
+                                        primary=True)
+        return None if team_users is None else {'team_name': team_name, 'members': team_users}
+
+    team = await team_cache.get_or_load(team_name, load_team)
+    if team is None:
         return JSONResponse(status_code=404, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_FOUND, message="team_name not found")
         ).__dict__())
     else:
-        return JSONResponse(status_code=200, content={'team_name': team_name,
-                                                      'members': [dict(user) for user in team_users]})
+        return JSONResponse(status_code=200, content=team)
+
+
+# even out open reviews of a team: the team's open pull requests with their reviewers are loaded with one query,
+# a balanced reassignment is planned in memory (see plan_rebalance) and applied with one batched transaction.
+# with dry_run the plan is only returned
+@router.post("/rebalance")
+async def rebalance_team(team_name: str = Body(...), dry_run: bool = Body(False),
+                         connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    members = await select_query(connection, '''
+                                 SELECT user_id, is_active, open_reviews FROM "user" WHERE team_name = %(team_name)s
+                                 ''', {'team_name': team_name}, prepare=True)
+    if members is None:
+        if await select_query(connection, 'SELECT team_name FROM team WHERE team_name = %(team_name)s',
+                              {'team_name': team_name}, return_one=True) is None:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message="team_name not found")
+            ).__dict__())
+        members = []
+
+    # pull requests are locked until the commit, so concurrent merges and reassigns don't interleave with the plan
+    pull_requests = await select_query(connection, '''
+                                       SELECT pr.pull_request_id, pr.author_id,
+                                           ARRAY(SELECT ra.reviewer_id FROM "assignment" ra
+                                                 WHERE ra.pull_request_id = pr.pull_request_id
+                                                 ORDER BY ra.reviewer_id) AS assigned_reviewers
+                                       FROM pull_request pr
+                                       WHERE pr.status = 'OPEN' AND pr.pull_request_id IN (
+                                           SELECT a.pull_request_id FROM "assignment" a
+                                           JOIN "user" u ON u.user_id = a.reviewer_id
+                                           WHERE u.team_name = %(team_name)s
+                                       )
+                                       ORDER BY pr.pull_request_id
+                                       ''' + ('' if dry_run else 'FOR UPDATE OF pr'), {'team_name': team_name},
+                                       prepare=True)
+
+    load_before = {member['user_id']: member['open_reviews'] for member in members}
+    replacements, load_changes = plan_rebalance(members, pull_requests or [])
+    if replacements and not dry_run:
+        if not await apply_replacements(connection, replacements, load_changes):
+            await connection.rollback()
+            return JSONResponse(status_code=500, content=ErrorResponse(Error(
+                code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to rebalance reviews'
+            )).__dict__())
+        await connection.commit()
+        # reviews of members whose load didn't change (a review given and another one taken) are changed too
+        review_cache.invalidate({user_id for replacement in replacements for user_id in replacement[1:]})
+    else:
+        await connection.rollback()
+
+    return JSONResponse(status_code=200, content={
+        'team_name': team_name,
+        'dry_run': dry_run,
+        'moves': [{'pull_request_id': pull_request_id, 'old_reviewer_id': old_reviewer_id,
+                   'new_reviewer_id': new_reviewer_id}
+                  for pull_request_id, old_reviewer_id, new_reviewer_id in replacements],
+        'load_before': load_before,
+        'load_after': {user_id: load + load_changes.get(user_id, 0) for user_id, load in load_before.items()}
+    })
@@ -1,83 +1,205 @@
-import json
+from fastapi import APIRouter, Body, Depends, Query
+from psycopg import AsyncConnection
+from psycopg.rows import class_row
 
-from fastapi import APIRouter, Body
-from fastapi.responses import JSONResponse
-
-from connection import connection
+from utils.responses import JSONResponse
 from utils.properties import ErrorCodes
-from utils.schemas import ErrorResponse, Error, User
-from utils.db_queries import select_query, change_data_query
-from api.pull_request import reassign_pull_request
+from utils.schemas import ErrorResponse, Error, User, PullRequestShort
+from utils.db_queries import DatabaseSession, select_query, change_data_query, get_connection, \
+    get_read_only_connection
+from utils.cache import team_cache, review_cache
+from utils.pagination import PAGE_LIMIT_MAX, select_page, ndjson_response
+from utils.reviewer_selection import lock_reviewed_pull_requests, lock_team_members, reassign_deactivated_reviewers
+from utils.jobs import DEACTIVATE_USERS_JOB, enqueue_job, jobs_enqueued
 
 
 router = APIRouter()
 
+# hot path queries, tests/test_indexes.py checks that their plans use the indexes
+REVIEW_QUERY = '''
+               SELECT r.pull_request_id, r.pull_request_name, r.author_id, r.status
+               FROM "user" u
+               LEFT JOIN (
+                   SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name,
+                       pr.author_id, pr.status
+                   FROM "assignment" a
+                   JOIN pull_request pr ON a.pull_request_id = pr.pull_request_id
+                   UNION ALL
+                   SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name,
+                       pr.author_id, pr.status
+                   FROM assignment_archive a
+                   JOIN pull_request_archive pr ON a.pull_request_id = pr.pull_request_id
+               ) r ON u.user_id = r.reviewer_id
+               WHERE u.user_id = %(user_id)s
+               '''
+
+REVIEWS_QUERY = '''
+                SELECT u.user_id, r.pull_request_id, r.pull_request_name, r.author_id, r.status
+                FROM "user" u
+                LEFT JOIN (
+                    SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name,
+                        pr.author_id, pr.status
+                    FROM "assignment" a
+                    JOIN pull_request pr ON a.pull_request_id = pr.pull_request_id
+                    UNION ALL
+                    SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name,
+                        pr.author_id, pr.status
+                    FROM assignment_archive a
+                    JOIN pull_request_archive pr ON a.pull_request_id = pr.pull_request_id
+                ) r ON u.user_id = r.reviewer_id
+                WHERE u.user_id = ANY(%(user_ids)s)
+                '''
+
 
 @router.post("/setIsActive")
-async def set_is_active(user_id: str = Body(...), is_active: bool = Body(...)):
-    if change_data_query('''
+async def set_is_active(user_id: str = Body(...), is_active: bool = Body(...),
+                        connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    if await change_data_query(connection, '''
         UPDATE "user" SET
             is_active = %(is_active)s
         WHERE user_id = %(user_id)s
-    ''', {'user_id': user_id, 'is_active': is_active}):
-        connection.commit()
-        user = select_query('SELECT * FROM "user" WHERE user_id = %(user_id)s',
-                            {'user_id': user_id}, return_one=True)
+    ''', {'user_id': user_id, 'is_active': is_active}, prepare=True):
+        await connection.commit()
+        user = await select_query(connection, '''
+                                  SELECT user_id, username, team_name, is_active FROM "user"
+                                  WHERE user_id = %(user_id)s
+                                  ''', {'user_id': user_id}, return_one=True, row_factory=class_row(User),
+                                  prepare=True)
+        team_cache.invalidate([user.team_name])
         return JSONResponse(status_code=200, content=user)
     else:
-        connection.rollback()
+        await connection.rollback()
         return JSONResponse(status_code=400, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_FOUND, message='user_id not found')).__dict__())
 
 
 @router.get("/getReview")
-async def get_review(user_id: str):
-    user_pull_requests = select_query('''
-                                      SELECT pr.pull_request_id, pr.pull_request_name, pr.author_id, pr.status
-                                      FROM "user" u
-                                      LEFT JOIN "assignment" a ON u.user_id = a.reviewer_id
-                                      LEFT JOIN pull_request pr ON a.pull_request_id = pr.pull_request_id
-                                      WHERE u.user_id = %(user_id)s
-                              ''', {'user_id': user_id})
-    if user_pull_requests is None:
+async def get_review(user_id: str, limit: int | None = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+                     cursor: str | None = None, stream: bool = False,
+                     connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # keyset paginated or streamed (NDJSON) pull requests for reviewers with long review queues
+    if limit is not None or cursor is not None or stream:
+        if await select_query(connection, 'SELECT user_id FROM "user" WHERE user_id = %(user_id)s',
+                              {'user_id': user_id}, return_one=True, prepare=True) is None:
+            return JSONResponse(status_code=404, content=ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message="user_id not found")
+            ).__dict__())
+        query = '''
+                SELECT pull_request_id, pull_request_name, author_id, status FROM (
+                    SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name, pr.author_id, pr.status
+                    FROM "assignment" a
+                    JOIN pull_request pr ON a.pull_request_id = pr.pull_request_id
+                    UNION ALL
+                    SELECT a.reviewer_id, pr.pull_request_id, pr.pull_request_name, pr.author_id, pr.status
+                    FROM assignment_archive a
+                    JOIN pull_request_archive pr ON a.pull_request_id = pr.pull_request_id
+                ) r
+                WHERE reviewer_id = %(user_id)s AND (%(after)s::text IS NULL OR pull_request_id > %(after)s)
+                ORDER BY pull_request_id
+                LIMIT %(limit)s
+                '''
+        if stream:
+            return ndjson_response(connection, query, {'user_id': user_id}, limit, cursor)
+        user_pull_requests, next_cursor = await select_page(connection, query, {'user_id': user_id},
+                                                            'pull_request_id', limit or PAGE_LIMIT_MAX, cursor)
+        return JSONResponse(status_code=200, content={'user_id': user_id, 'members': user_pull_requests,
+                                                      'next_cursor': next_cursor})
+
+    # review queues are cached until one of their pull requests or assignments change or TTL expiration.
+    # they are read from the primary, rows of a lagging replica would stay in the cache
+    # concurrent misses of the same review queue share one query
+    async def load_review() -> dict | None:
+        user_pull_requests = await select_query(connection, REVIEW_QUERY, {'user_id': user_id},
+                                                row_factory=class_row(PullRequestShort), prepare=True, primary=True)
+        return None if user_pull_requests is None else {'user_id': user_id, 'members': user_pull_requests}
+
+    review = await review_cache.get_or_load(user_id, load_review)
+    if review is None:
         return JSONResponse(status_code=404, content=ErrorResponse(Error(
             code=ErrorCodes.NOT_FOUND, message="user_id not found")
         ).__dict__())
     else:
-        return JSONResponse(status_code=200, content={'user_id': user_id,
-                                                      'members': [dict(pr) for pr in user_pull_requests]})
+        return JSONResponse(status_code=200, content=review)
+
+
+# review queues of many users in the shape of /users/getReview responses, results are in the order of the request.
+# cached queues are taken from the cache, the rest are read with one query. they aren't put into the cache,
+# invalidations of single users can't be tracked for a batch load, so the rest can be read from the replica
+@router.post("/getReviewMany")
+async def get_reviews(user_ids: list[str] = Body(..., embed=True),
+                      connection: DatabaseSession | AsyncConnection = Depends(get_read_only_connection)):
+    # remove duplicates but keep order of users in request
+    user_ids = list(dict.fromkeys(user_ids))
+
+    reviews = {user_id: review for user_id in user_ids if (review := review_cache.get(user_id)) is not None}
+    missing_user_ids = [user_id for user_id in user_ids if user_id not in reviews]
+    if missing_user_ids:
+        rows = await select_query(connection, REVIEWS_QUERY, {'user_ids': missing_user_ids}, prepare=True)
+        for row in rows or []:
+            user_id = row.pop('user_id')
+            reviews.setdefault(user_id, {'user_id': user_id, 'members': []})['members'].append(PullRequestShort(**row))
+
+    results = []
+    for user_id in user_ids:
+        if user_id in reviews:
+            results.append({'user_id': user_id, 'status': 200, 'members': reviews[user_id]['members']})
+        else:
+            results.append({'user_id': user_id, 'status': 404, 'error': ErrorResponse(Error(
+                code=ErrorCodes.NOT_FOUND, message='user_id not found'
+            )).__dict__()})
+    return JSONResponse(status_code=200, content={'results': results})
 
 
 # deactivate a list of users and reassign their reviewed opened pull requests
-# if reassign is not possible, just delete this user from pull request
+# if reassign is not possible, reviewer stays assigned and NO_CANDIDATE error is returned for this pull request
+# the whole operation is done with a fixed number of set-based queries and one commit, regardless of users amount.
+# with background=true it's enqueued as a job processed in batches, 202 with job_id is returned at once
+# and the progress and reassignments are reported by /jobs/{job_id}
 @router.post("/deactivateMany")
-async def deactivate_users(users: list[str] = Body(..., embed=True)):
-    reassign_responses = {}
-    for user_id in users:
-        if select_query('SELECT user_id FROM "user" WHERE user_id = %(user_id)s',
-                        {'user_id': user_id}, return_one=True) is None:
-            return JSONResponse(status_code=404, content=ErrorResponse(Error(
-                code=ErrorCodes.NOT_FOUND, message="user_id not found"
-            )).__dict__())
-
-        # deactivate user
-        change_data_query('UPDATE "user" SET is_active = FALSE WHERE user_id = %(user_id)s',
-                          {'user_id': user_id})
-
-        # get assigned opened pull requests
-        assigned_requests = select_query('''
-                                         SELECT pr.pull_request_id FROM pull_request pr
-                                         JOIN assignment a ON pr.pull_request_id = a.pull_request_id
-                                         JOIN "user" u ON a.reviewer_id = u.user_id
-                                         WHERE u.user_id = %(user_id)s AND pr.status = 'OPEN'
-                                         ''', {'user_id': user_id})
-        # reassign opened pull requests where user was a reviewer
-        if assigned_requests is None:
-            continue
-        reassign_responses[user_id] = []
-        for pr in assigned_requests:
-            reassign_response = await reassign_pull_request(pr['pull_request_id'], user_id)
-            reassign_responses[user_id].append(json.loads(reassign_response.body))
+async def deactivate_users(users: list[str] = Body(..., embed=True), background: bool = False,
+                           connection: DatabaseSession | AsyncConnection = Depends(get_connection)):
+    # remove duplicates but keep order of users in request
+    users = list(dict.fromkeys(users))
+    if not users:
+        return JSONResponse(status_code=200, content={'reassignments': {}})
+
+    # check that all users exist at once
+    existing_users = await select_query(connection, '''
+                                        SELECT user_id, team_name FROM "user" WHERE user_id = ANY(%(users)s)
+                                        ''', {'users': users})
+    if existing_users is None or len(existing_users) != len(users):
+        return JSONResponse(status_code=404, content=ErrorResponse(Error(
+            code=ErrorCodes.NOT_FOUND, message="user_id not found"
+        )).__dict__())
+
+    if background:
+        job_id = await enqueue_job(connection, DEACTIVATE_USERS_JOB, {'users': users},
+                                   {'deactivated': False, 'processed': 0, 'total': len(users)})
+        await connection.commit()
+        jobs_enqueued.set()
+        return JSONResponse(status_code=202, content={'job_id': job_id, 'status': 'QUEUED'},
+                            headers={'Location': f'/jobs/{job_id}'})
+
+    # pull requests are locked before the users, in the same order as /pullRequest/reassign locks them
+    await lock_reviewed_pull_requests(connection, users)
+    # the users and their teammates, replacements are chosen among them, are locked with one statement in user_id
+    # order. replacements locked after the users would be locked out of this order
+    await lock_team_members(connection, list({user['team_name'] for user in existing_users}))
+    # deactivate all users with one statement
+    await change_data_query(connection, 'UPDATE "user" SET is_active = FALSE WHERE user_id = ANY(%(users)s)',
+                            {'users': users})
+
+    # pull requests are already locked above
+    reassignment = await reassign_deactivated_reviewers(connection, users, lock_pull_requests=False)
+    if reassignment is None:
+        await connection.rollback()
+        return JSONResponse(status_code=500, content=ErrorResponse(Error(
+            code=ErrorCodes.SERVER_ERROR, message='Internal Server Error, unable to reassign pull requests'
+        )).__dict__())
+    reassign_responses, replacements = reassignment
 
+    await connection.commit()
+    team_cache.invalidate({user['team_name'] for user in existing_users})
+    review_cache.invalidate({user_id for replacement in replacements for user_id in replacement[1:]})
     # return reassign responses content
     return JSONResponse(status_code=200, content={'reassignments': reassign_responses})
@@ -1,10 +1,38 @@
-import psycopg2
+from psycopg import AsyncConnection
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 
-from variables import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from variables import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, \
+    DB_POOL_TIMEOUT, DB_PREPARE_THRESHOLD, DB_PREPARED_MAX, DB_READ_DSN
 
 
-try:
-    connection = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
-except:
-    print(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
-    print("Unable to connect to the database")
+# size of the per-connection prepared statements cache, see select_query in utils/db_queries.py
+async def configure_connection(connection: AsyncConnection):
+    connection.prepared_max = DB_PREPARED_MAX
+
+
+# pool is created closed, it's opened on application startup (see lifespan in main.py) because
+# async connections can only be opened inside a running event loop. every worker process imports
+# this module and has its own pool, so DB_POOL_MAX_SIZE is per worker
+pool = AsyncConnectionPool(
+    make_conninfo(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT),
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    # how long a request waits for a free connection before PoolTimeout is raised
+    timeout=DB_POOL_TIMEOUT,
+    kwargs={'row_factory': dict_row, 'prepare_threshold': DB_PREPARE_THRESHOLD},
+    configure=configure_connection,
+    open=False
+)
+
+# read replica pool with the same settings, None if DB_READ_DSN is not set
+replica_pool = AsyncConnectionPool(
+    DB_READ_DSN,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    kwargs={'row_factory': dict_row, 'prepare_threshold': DB_PREPARE_THRESHOLD},
+    configure=configure_connection,
+    open=False
+) if DB_READ_DSN else None
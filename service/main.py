@@ -1,24 +1,99 @@
-from fastapi import FastAPI
-import uvicorn
 import asyncio
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from psycopg_pool import PoolTimeout
+import uvicorn
+
+from connection import pool, replica_pool
+from variables import APP_HOST, APP_PORT, APP_WORKERS, APP_LOOP, APP_HTTP, APP_GRACEFUL_SHUTDOWN_TIMEOUT, \
+    APP_KEEP_ALIVE_TIMEOUT, DB_APPLY_MIGRATIONS, ARCHIVE_INTERVAL, \
+    JOB_WORKERS
+from api import team, users, pull_request, statistics, jobs
+from utils.responses import JSONResponse
+from utils.schemas import ErrorResponse, Error
+from utils.properties import ErrorCodes
+from utils.migrations import apply_migrations
+from utils.archive import run_periodic_archival
+from utils.jobs import run_job_worker
+from utils.invalidation import run_invalidation_publisher, run_invalidation_listener
+from utils.pagination import InvalidCursorError
+from utils.metrics import MetricsMiddleware, render_metrics
+from utils.cache import team_cache, review_cache, statistics_cache
+
+
+# runs in every worker process: each worker opens its own connection pool and closes it on shutdown,
+# after in-flight requests are drained. concurrent migrations of workers are serialized by an advisory lock
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pool.open(wait=True)
+    if replica_pool is not None:
+        await replica_pool.open(wait=True)
+    if DB_APPLY_MIGRATIONS:
+        async with pool.connection() as connection:
+            await apply_migrations(connection)
+    # batches of concurrent workers skip each other's rows, so every worker may run the archival
+    tasks = [asyncio.create_task(run_periodic_archival())] if ARCHIVE_INTERVAL > 0 else []
+    # background job workers, they claim jobs of all processes
+    tasks += [asyncio.create_task(run_job_worker()) for _ in range(JOB_WORKERS)]
+    # caches of this process and of other ones are invalidated together
+    tasks += [asyncio.create_task(run_invalidation_publisher()), asyncio.create_task(run_invalidation_listener())]
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    await pool.close()
+    if replica_pool is not None:
+        await replica_pool.close()
 
-from variables import APP_HOST, APP_PORT
-from api import team, users, pull_request, statistics
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
 
 app.include_router(team.router, prefix="/team", tags=["team"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(pull_request.router, prefix="/pullRequest", tags=["pull_request"])
 app.include_router(statistics.router, prefix="/statistics", tags=["statistics"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.add_middleware(MetricsMiddleware)
+
+
+# prometheus scrape endpoint: per route latency and status codes, per request and per query database usage
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    pools_stats = {'primary': pool.get_stats()}
+    if replica_pool is not None:
+        pools_stats['replica'] = replica_pool.get_stats()
+    return PlainTextResponse(render_metrics((team_cache, review_cache, statistics_cache), pools_stats),
+                             media_type='text/plain; version=0.0.4')
+
+
+# all pooled connections are busy longer than DB_POOL_TIMEOUT
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content=ErrorResponse(Error(
+        code=ErrorCodes.SERVER_ERROR, message='Service Unavailable, no free database connection'
+    )).__dict__())
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(status_code=400, content=ErrorResponse(Error(
+        code=ErrorCodes.BAD_REQUEST, message='invalid pagination cursor'
+    )).__dict__())
 
 
 if __name__ == "__main__":
-    config = uvicorn.Config(
-        app,
+    # the application is passed as an import string, so every worker process imports it on its own
+    uvicorn.run(
+        "main:app",
         host=APP_HOST,
         port=APP_PORT,
-        loop="asyncio"
+        workers=APP_WORKERS,
+        loop=APP_LOOP,
+        http=APP_HTTP,
+        timeout_graceful_shutdown=APP_GRACEFUL_SHUTDOWN_TIMEOUT,
+        timeout_keep_alive=APP_KEEP_ALIVE_TIMEOUT
     )
-    server = uvicorn.Server(config)
-    asyncio.run(server.serve())
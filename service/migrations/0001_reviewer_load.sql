@@ -0,0 +1,11 @@
+-- amount of open pull requests every user reviews, used to pick the least loaded reviewers
+ALTER TABLE "user" ADD COLUMN IF NOT EXISTS open_reviews INTEGER NOT NULL DEFAULT 0;
+
+UPDATE "user" u SET open_reviews = (
+	SELECT COUNT(*) FROM "assignment" a
+	JOIN pull_request pr ON pr.pull_request_id = a.pull_request_id
+	WHERE a.reviewer_id = u.user_id AND pr.status = 'OPEN'
+);
+
+-- active team members ordered by their review load
+CREATE INDEX IF NOT EXISTS user_team_load_idx ON "user"(team_name, open_reviews, user_id) WHERE is_active;
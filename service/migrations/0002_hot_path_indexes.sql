@@ -0,0 +1,16 @@
+-- a reviewer can be assigned to a pull request only once, duplicates are removed before the constraint is added
+DELETE FROM "assignment" a
+USING "assignment" d
+WHERE a.pull_request_id = d.pull_request_id AND a.reviewer_id = d.reviewer_id AND a.assignment_id > d.assignment_id;
+
+-- reviewers of a pull request: merge, reassign, statistics
+ALTER TABLE "assignment" ADD CONSTRAINT assignment_pull_request_reviewer_key UNIQUE (pull_request_id, reviewer_id);
+
+-- pull requests of a reviewer: getReview, deactivateMany
+CREATE INDEX IF NOT EXISTS assignment_reviewer_idx ON "assignment"(reviewer_id, pull_request_id);
+
+-- team members: team/get
+CREATE INDEX IF NOT EXISTS user_team_name_idx ON "user"(team_name);
+
+-- open pull requests and their age
+CREATE INDEX IF NOT EXISTS pull_request_status_created_at_idx ON pull_request(status, created_at);
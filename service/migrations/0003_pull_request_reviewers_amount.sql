@@ -0,0 +1,7 @@
+-- amount of reviewers assigned to a pull request, it's kept up to date together with assignment writes,
+-- so reviewers statistics doesn't aggregate the whole assignment table
+ALTER TABLE pull_request ADD COLUMN IF NOT EXISTS reviewers_amount INTEGER NOT NULL DEFAULT 0;
+
+UPDATE pull_request pr SET reviewers_amount = (
+	SELECT COUNT(*) FROM "assignment" a WHERE a.pull_request_id = pr.pull_request_id
+);
@@ -0,0 +1,4 @@
+-- team members ordered by user_id for keyset pagination of team/get, replaces the index on team_name only
+CREATE INDEX IF NOT EXISTS user_team_name_user_id_idx ON "user"(team_name, user_id);
+
+DROP INDEX IF EXISTS user_team_name_idx;
@@ -0,0 +1,122 @@
+-- merge and reassign are done by one function call each: one round trip and one transaction,
+-- the pull request row is locked first, so concurrent calls for the same pull request are serialized.
+-- result is 'OK' or error code returned by the endpoint
+
+CREATE OR REPLACE FUNCTION merge_pull_request(p_pull_request_id TEXT, p_merged_at TIMESTAMP)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[]
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	reviewers TEXT[];
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	IF NOT FOUND THEN
+		RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[];
+		RETURN;
+	END IF;
+
+	reviewers := ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id
+					   ORDER BY reviewer_id);
+
+	-- merge is idempotent, already merged pull request is returned as is
+	IF pr.status = 'OPEN' THEN
+		UPDATE pull_request SET status = 'MERGED', merged_at = p_merged_at
+		WHERE pull_request_id = p_pull_request_id
+		RETURNING * INTO pr;
+
+		-- merged pull request is not a part of reviewers load anymore
+		UPDATE "user" SET open_reviews = open_reviews - 1 WHERE user_id = ANY(reviewers);
+	END IF;
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at, reviewers;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION reassign_pull_request(p_pull_request_id TEXT, p_old_user_id TEXT)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[],
+	replaced_by TEXT
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	old_user_team_name TEXT;
+	candidate TEXT;
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	SELECT team_name INTO old_user_team_name FROM "user" WHERE user_id = p_old_user_id;
+	IF pr.pull_request_id IS NULL OR old_user_team_name IS NULL THEN
+		RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF pr.status = 'MERGED' THEN
+		RETURN QUERY SELECT 'PR_MERGED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF NOT EXISTS (SELECT 1 FROM "assignment"
+				   WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id) THEN
+		RETURN QUERY SELECT 'NOT_ASSIGNED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	-- the least loaded active teammate who is neither the author nor a reviewer of this pull request,
+	-- users locked by concurrent assignments are skipped, so parallel reassigns spread over the team
+	SELECT user_id INTO candidate FROM "user" u
+	WHERE team_name = old_user_team_name AND is_active AND user_id <> pr.author_id AND
+		NOT EXISTS (SELECT 1 FROM "assignment" a
+					WHERE a.pull_request_id = p_pull_request_id AND a.reviewer_id = u.user_id)
+	ORDER BY open_reviews, user_id
+	LIMIT 1
+	FOR UPDATE SKIP LOCKED;
+
+	-- all candidates are locked right now, wait for the least loaded one instead of reporting no candidate
+	IF candidate IS NULL THEN
+		SELECT user_id INTO candidate FROM "user" u
+		WHERE team_name = old_user_team_name AND is_active AND user_id <> pr.author_id AND
+			NOT EXISTS (SELECT 1 FROM "assignment" a
+						WHERE a.pull_request_id = p_pull_request_id AND a.reviewer_id = u.user_id)
+		ORDER BY open_reviews, user_id
+		LIMIT 1
+		FOR UPDATE;
+	END IF;
+
+	IF candidate IS NULL THEN
+		RETURN QUERY SELECT 'NO_CANDIDATE', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	UPDATE "assignment" SET reviewer_id = candidate
+	WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id;
+
+	UPDATE "user" SET open_reviews = open_reviews + CASE WHEN user_id = candidate THEN 1 ELSE -1 END
+	WHERE user_id IN (candidate, p_old_user_id);
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at,
+		ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id ORDER BY reviewer_id),
+		candidate;
+END;
+$$;
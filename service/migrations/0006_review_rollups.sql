@@ -0,0 +1,142 @@
+-- pre-aggregated review statistics, kept up to date by statement triggers on pull_request:
+-- inserts (/pullRequest/create, /pullRequest/createMany) count created pull requests per day and team,
+-- OPEN -> MERGED updates (/pullRequest/merge) count merged ones and add their time to merge to histograms.
+-- statistics endpoints read these tables only, their cost doesn't depend on the amount of pull requests.
+-- team of a pull request is the author's team at the moment of the event
+
+-- time to merge histograms, bucket is merge_time_bucket(seconds): logarithmic buckets about 5% wide
+CREATE TABLE IF NOT EXISTS team_merge_time (
+	team_name TEXT NOT NULL,
+	bucket INTEGER NOT NULL,
+	pull_requests BIGINT NOT NULL DEFAULT 0,
+	seconds_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+	PRIMARY KEY (team_name, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS author_merge_time (
+	author_id TEXT NOT NULL,
+	team_name TEXT NOT NULL,
+	bucket INTEGER NOT NULL,
+	pull_requests BIGINT NOT NULL DEFAULT 0,
+	seconds_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+	PRIMARY KEY (author_id, team_name, bucket)
+);
+
+CREATE INDEX IF NOT EXISTS author_merge_time_team_name_idx ON author_merge_time (team_name);
+
+CREATE TABLE IF NOT EXISTS daily_throughput (
+	day DATE NOT NULL,
+	team_name TEXT NOT NULL,
+	created BIGINT NOT NULL DEFAULT 0,
+	merged BIGINT NOT NULL DEFAULT 0,
+	PRIMARY KEY (day, team_name)
+);
+
+CREATE INDEX IF NOT EXISTS daily_throughput_team_name_day_idx ON daily_throughput (team_name, day);
+
+
+-- the same formula is used to read the histograms in utils/rollups.py
+CREATE OR REPLACE FUNCTION merge_time_bucket(seconds DOUBLE PRECISION)
+RETURNS INTEGER
+LANGUAGE sql IMMUTABLE AS $$
+	SELECT floor(ln(1 + greatest(seconds, 0)) * 20)::INTEGER
+$$;
+
+
+-- rows are upserted in key order, so concurrent statements lock them in the same order and can't deadlock
+CREATE OR REPLACE FUNCTION rollup_created_pull_requests()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+	INSERT INTO daily_throughput AS t (day, team_name, created)
+	SELECT n.created_at::DATE, u.team_name, COUNT(*)
+	FROM new_pull_requests n
+	JOIN "user" u ON u.user_id = n.author_id
+	GROUP BY 1, 2
+	ORDER BY 1, 2
+	ON CONFLICT (day, team_name) DO UPDATE SET created = t.created + excluded.created;
+	RETURN NULL;
+END;
+$$;
+
+
+-- one statement: merged pull requests are selected once and all rollups are updated by data-modifying CTEs
+CREATE OR REPLACE FUNCTION rollup_merged_pull_requests()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+	WITH merged AS (
+		SELECT n.author_id, u.team_name, n.merged_at::DATE AS day,
+			   EXTRACT(EPOCH FROM n.merged_at - n.created_at)::DOUBLE PRECISION AS seconds
+		FROM new_pull_requests n
+		JOIN old_pull_requests o ON o.pull_request_id = n.pull_request_id
+		JOIN "user" u ON u.user_id = n.author_id
+		WHERE o.status = 'OPEN' AND n.status = 'MERGED'
+	), daily AS (
+		INSERT INTO daily_throughput AS t (day, team_name, merged)
+		SELECT day, team_name, COUNT(*) FROM merged
+		GROUP BY 1, 2
+		ORDER BY 1, 2
+		ON CONFLICT (day, team_name) DO UPDATE SET merged = t.merged + excluded.merged
+	), team AS (
+		INSERT INTO team_merge_time AS t (team_name, bucket, pull_requests, seconds_sum)
+		SELECT team_name, merge_time_bucket(seconds), COUNT(*), SUM(seconds) FROM merged
+		GROUP BY 1, 2
+		ORDER BY 1, 2
+		ON CONFLICT (team_name, bucket) DO UPDATE SET pull_requests = t.pull_requests + excluded.pull_requests,
+													  seconds_sum = t.seconds_sum + excluded.seconds_sum
+	)
+	INSERT INTO author_merge_time AS t (author_id, team_name, bucket, pull_requests, seconds_sum)
+	SELECT author_id, team_name, merge_time_bucket(seconds), COUNT(*), SUM(seconds) FROM merged
+	GROUP BY 1, 2, 3
+	ORDER BY 1, 2, 3
+	ON CONFLICT (author_id, team_name, bucket) DO UPDATE SET pull_requests = t.pull_requests + excluded.pull_requests,
+															 seconds_sum = t.seconds_sum + excluded.seconds_sum;
+	RETURN NULL;
+END;
+$$;
+
+
+-- triggers are created before the backfill: they lock pull_request against concurrent writes until the
+-- migration is committed, so no pull request is counted twice or missed
+DROP TRIGGER IF EXISTS pull_request_created_rollup ON pull_request;
+CREATE TRIGGER pull_request_created_rollup
+AFTER INSERT ON pull_request
+REFERENCING NEW TABLE AS new_pull_requests
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_created_pull_requests();
+
+DROP TRIGGER IF EXISTS pull_request_merged_rollup ON pull_request;
+CREATE TRIGGER pull_request_merged_rollup
+AFTER UPDATE ON pull_request
+REFERENCING OLD TABLE AS old_pull_requests NEW TABLE AS new_pull_requests
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_merged_pull_requests();
+
+
+TRUNCATE daily_throughput, team_merge_time, author_merge_time;
+
+INSERT INTO daily_throughput (day, team_name, created, merged)
+SELECT day, team_name, SUM(created), SUM(merged)
+FROM (
+	SELECT pr.created_at::DATE AS day, u.team_name, 1 AS created, 0 AS merged
+	FROM pull_request pr JOIN "user" u ON u.user_id = pr.author_id
+	UNION ALL
+	SELECT pr.merged_at::DATE, u.team_name, 0, 1
+	FROM pull_request pr JOIN "user" u ON u.user_id = pr.author_id
+	WHERE pr.status = 'MERGED'
+) events
+GROUP BY 1, 2;
+
+INSERT INTO team_merge_time (team_name, bucket, pull_requests, seconds_sum)
+SELECT u.team_name, merge_time_bucket(EXTRACT(EPOCH FROM pr.merged_at - pr.created_at)::DOUBLE PRECISION), COUNT(*),
+	   SUM(EXTRACT(EPOCH FROM pr.merged_at - pr.created_at)::DOUBLE PRECISION)
+FROM pull_request pr JOIN "user" u ON u.user_id = pr.author_id
+WHERE pr.status = 'MERGED'
+GROUP BY 1, 2;
+
+INSERT INTO author_merge_time (author_id, team_name, bucket, pull_requests, seconds_sum)
+SELECT pr.author_id, u.team_name,
+	   merge_time_bucket(EXTRACT(EPOCH FROM pr.merged_at - pr.created_at)::DOUBLE PRECISION), COUNT(*),
+	   SUM(EXTRACT(EPOCH FROM pr.merged_at - pr.created_at)::DOUBLE PRECISION)
+FROM pull_request pr JOIN "user" u ON u.user_id = pr.author_id
+WHERE pr.status = 'MERGED'
+GROUP BY 1, 2, 3;
@@ -0,0 +1,240 @@
+-- cold storage of merged pull requests: archive_merged_pull_requests moves pull requests merged long ago together
+-- with their assignments from the hot tables to archive tables partitioned by month of created_at.
+-- hot tables and their indexes keep open and recently merged pull requests only, which is what the hot queries
+-- (reviewer search, deactivateMany, reassign) read. lookups by id fall back to the archive.
+-- pull_request itself isn't partitioned: a partitioned table can't have a unique pull_request_id
+-- without the partition key, which assignment foreign key and duplicate checks rely on
+
+CREATE TABLE IF NOT EXISTS pull_request_archive (
+	pull_request_id TEXT NOT NULL,
+	pull_request_name TEXT NOT NULL,
+	author_id TEXT REFERENCES "user"(user_id) NOT NULL,
+	status pull_request_status_type NOT NULL,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	reviewers_amount INTEGER NOT NULL DEFAULT 0,
+	archived_at TIMESTAMP NOT NULL DEFAULT now()
+) PARTITION BY RANGE (created_at);
+
+-- created_at of assignments is created_at of their pull request, so both are archived to the same month
+CREATE TABLE IF NOT EXISTS assignment_archive (
+	assignment_id CHARACTER VARYING(36) NOT NULL,
+	pull_request_id TEXT NOT NULL,
+	reviewer_id TEXT REFERENCES "user"(user_id) NOT NULL,
+	created_at TIMESTAMP
+) PARTITION BY RANGE (created_at);
+
+-- rows without created_at, monthly partitions are created by archive_merged_pull_requests
+CREATE TABLE IF NOT EXISTS pull_request_archive_default PARTITION OF pull_request_archive DEFAULT;
+CREATE TABLE IF NOT EXISTS assignment_archive_default PARTITION OF assignment_archive DEFAULT;
+
+-- lookups by id: merge, reassign, create duplicate checks, statistics
+CREATE INDEX IF NOT EXISTS pull_request_archive_pull_request_id_idx ON pull_request_archive(pull_request_id);
+CREATE INDEX IF NOT EXISTS assignment_archive_pull_request_id_idx ON assignment_archive(pull_request_id);
+-- archived pull requests of a reviewer: getReview
+CREATE INDEX IF NOT EXISTS assignment_archive_reviewer_idx ON assignment_archive(reviewer_id, pull_request_id);
+
+-- archival candidates
+CREATE INDEX IF NOT EXISTS pull_request_merged_at_idx ON pull_request(merged_at) WHERE status = 'MERGED';
+
+
+CREATE OR REPLACE FUNCTION create_archive_partitions(p_month DATE)
+RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+	archive_table TEXT;
+	month_start DATE := date_trunc('month', p_month)::DATE;
+BEGIN
+	FOREACH archive_table IN ARRAY ARRAY['pull_request_archive', 'assignment_archive'] LOOP
+		EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+					   archive_table || '_' || to_char(month_start, 'YYYY_MM'), archive_table,
+					   month_start, (month_start + INTERVAL '1 month')::DATE);
+	END LOOP;
+END;
+$$;
+
+
+-- moves up to p_batch_size pull requests merged before p_merged_before to the archive, returns their amount.
+-- pull requests locked by running requests are skipped, they are archived by one of the next runs
+CREATE OR REPLACE FUNCTION archive_merged_pull_requests(p_merged_before TIMESTAMP, p_batch_size INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+	archived_ids TEXT[];
+	archive_month DATE;
+BEGIN
+	-- partitions are created on the fly, concurrent runs are serialized
+	PERFORM pg_advisory_xact_lock(7305147);
+
+	archived_ids := ARRAY(
+		SELECT pull_request_id FROM pull_request
+		WHERE status = 'MERGED' AND merged_at < p_merged_before
+		ORDER BY merged_at
+		LIMIT p_batch_size
+		FOR UPDATE SKIP LOCKED
+	);
+	IF cardinality(archived_ids) = 0 THEN
+		RETURN 0;
+	END IF;
+
+	FOR archive_month IN
+		SELECT DISTINCT date_trunc('month', created_at)::DATE FROM pull_request
+		WHERE pull_request_id = ANY(archived_ids) AND created_at IS NOT NULL
+	LOOP
+		PERFORM create_archive_partitions(archive_month);
+	END LOOP;
+
+	WITH moved AS (
+		DELETE FROM "assignment" a
+		USING pull_request pr
+		WHERE a.pull_request_id = pr.pull_request_id AND pr.pull_request_id = ANY(archived_ids)
+		RETURNING a.assignment_id, a.pull_request_id, a.reviewer_id, pr.created_at
+	)
+	INSERT INTO assignment_archive (assignment_id, pull_request_id, reviewer_id, created_at)
+	SELECT assignment_id, pull_request_id, reviewer_id, created_at FROM moved;
+
+	WITH moved AS (
+		DELETE FROM pull_request WHERE pull_request_id = ANY(archived_ids)
+		RETURNING pull_request_id, pull_request_name, author_id, status, created_at, merged_at, reviewers_amount
+	)
+	INSERT INTO pull_request_archive (pull_request_id, pull_request_name, author_id, status, created_at, merged_at,
+									  reviewers_amount)
+	SELECT pull_request_id, pull_request_name, author_id, status, created_at, merged_at, reviewers_amount FROM moved;
+
+	RETURN cardinality(archived_ids);
+END;
+$$;
+
+
+-- merge of an archived pull request returns it as is, like merge of any merged pull request
+CREATE OR REPLACE FUNCTION merge_pull_request(p_pull_request_id TEXT, p_merged_at TIMESTAMP)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[]
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	reviewers TEXT[];
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	IF NOT FOUND THEN
+		RETURN QUERY SELECT 'OK', a.pull_request_name, a.author_id, a.status, a.created_at, a.merged_at,
+			ARRAY(SELECT reviewer_id FROM assignment_archive WHERE pull_request_id = p_pull_request_id
+				  ORDER BY reviewer_id)
+		FROM pull_request_archive a WHERE a.pull_request_id = p_pull_request_id;
+		IF NOT FOUND THEN
+			RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+				NULL::TIMESTAMP, NULL::TEXT[];
+		END IF;
+		RETURN;
+	END IF;
+
+	reviewers := ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id
+					   ORDER BY reviewer_id);
+
+	-- merge is idempotent, already merged pull request is returned as is
+	IF pr.status = 'OPEN' THEN
+		UPDATE pull_request SET status = 'MERGED', merged_at = p_merged_at
+		WHERE pull_request_id = p_pull_request_id
+		RETURNING * INTO pr;
+
+		-- merged pull request is not a part of reviewers load anymore
+		UPDATE "user" SET open_reviews = open_reviews - 1 WHERE user_id = ANY(reviewers);
+	END IF;
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at, reviewers;
+END;
+$$;
+
+
+-- archived pull requests are merged, so their reassignment is PR_MERGED
+CREATE OR REPLACE FUNCTION reassign_pull_request(p_pull_request_id TEXT, p_old_user_id TEXT)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[],
+	replaced_by TEXT
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	old_user_team_name TEXT;
+	candidate TEXT;
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	SELECT team_name INTO old_user_team_name FROM "user" WHERE user_id = p_old_user_id;
+	IF old_user_team_name IS NOT NULL AND pr.pull_request_id IS NULL AND
+	   EXISTS (SELECT 1 FROM pull_request_archive a WHERE a.pull_request_id = p_pull_request_id) THEN
+		RETURN QUERY SELECT 'PR_MERGED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+	IF pr.pull_request_id IS NULL OR old_user_team_name IS NULL THEN
+		RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF pr.status = 'MERGED' THEN
+		RETURN QUERY SELECT 'PR_MERGED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF NOT EXISTS (SELECT 1 FROM "assignment"
+				   WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id) THEN
+		RETURN QUERY SELECT 'NOT_ASSIGNED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	-- the least loaded active teammate who is neither the author nor a reviewer of this pull request,
+	-- users locked by concurrent assignments are skipped, so parallel reassigns spread over the team
+	SELECT user_id INTO candidate FROM "user" u
+	WHERE team_name = old_user_team_name AND is_active AND user_id <> pr.author_id AND
+		NOT EXISTS (SELECT 1 FROM "assignment" a
+					WHERE a.pull_request_id = p_pull_request_id AND a.reviewer_id = u.user_id)
+	ORDER BY open_reviews, user_id
+	LIMIT 1
+	FOR UPDATE SKIP LOCKED;
+
+	-- all candidates are locked right now, wait for the least loaded one instead of reporting no candidate
+	IF candidate IS NULL THEN
+		SELECT user_id INTO candidate FROM "user" u
+		WHERE team_name = old_user_team_name AND is_active AND user_id <> pr.author_id AND
+			NOT EXISTS (SELECT 1 FROM "assignment" a
+						WHERE a.pull_request_id = p_pull_request_id AND a.reviewer_id = u.user_id)
+		ORDER BY open_reviews, user_id
+		LIMIT 1
+		FOR UPDATE;
+	END IF;
+
+	IF candidate IS NULL THEN
+		RETURN QUERY SELECT 'NO_CANDIDATE', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	UPDATE "assignment" SET reviewer_id = candidate
+	WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id;
+
+	UPDATE "user" SET open_reviews = open_reviews + CASE WHEN user_id = candidate THEN 1 ELSE -1 END
+	WHERE user_id IN (candidate, p_old_user_id);
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at,
+		ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id ORDER BY reviewer_id),
+		candidate;
+END;
+$$;
@@ -0,0 +1,22 @@
+-- background jobs of bulk endpoints (e.g. /users/deactivateMany?background=true), see utils/jobs.py.
+-- workers of all processes claim queued jobs with SKIP LOCKED, a running job is leased by its worker:
+-- heartbeat_at is renewed with every progress checkpoint and a job whose lease has expired (the worker died)
+-- is claimed again and resumed from its last checkpoint. attempts identifies the current lease
+CREATE TABLE IF NOT EXISTS job (
+	job_id CHARACTER VARYING(36) PRIMARY KEY DEFAULT uuid_generate_v4(),
+	kind TEXT NOT NULL,
+	status TEXT NOT NULL DEFAULT 'QUEUED' CHECK (status IN ('QUEUED', 'RUNNING', 'DONE', 'FAILED')),
+	-- job arguments, progress checkpoint and partial results, their content depends on kind
+	payload JSONB NOT NULL,
+	progress JSONB NOT NULL DEFAULT '{}',
+	result JSONB NOT NULL DEFAULT '{}',
+	error TEXT,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	started_at TIMESTAMP,
+	heartbeat_at TIMESTAMP,
+	finished_at TIMESTAMP
+);
+
+-- claim order, finished jobs drop out of the index
+CREATE INDEX IF NOT EXISTS job_unfinished_idx ON job(created_at) WHERE status IN ('QUEUED', 'RUNNING');
@@ -0,0 +1,137 @@
+-- rows of "user" are locked in user_id order by every writer of open_reviews (see lock_users in
+-- utils/reviewer_selection.py), so concurrent requests wait for each other instead of deadlocking.
+-- before this migration reassign_pull_request locked its candidate first and the old reviewer after it,
+-- two reassigns with swapped users deadlocked.
+-- rows are locked FOR NO KEY UPDATE, the lock an UPDATE of open_reviews takes anyway: unlike FOR UPDATE it doesn't
+-- conflict with KEY SHARE locks of foreign key checks, which transactions inserting assignments of the same users
+-- hold until their commit
+
+
+-- reviewers of the merged pull request are locked in user_id order before their counters are changed
+CREATE OR REPLACE FUNCTION merge_pull_request(p_pull_request_id TEXT, p_merged_at TIMESTAMP)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[]
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	reviewers TEXT[];
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	IF NOT FOUND THEN
+		RETURN QUERY SELECT 'OK', a.pull_request_name, a.author_id, a.status, a.created_at, a.merged_at,
+			ARRAY(SELECT reviewer_id FROM assignment_archive WHERE pull_request_id = p_pull_request_id
+				  ORDER BY reviewer_id)
+		FROM pull_request_archive a WHERE a.pull_request_id = p_pull_request_id;
+		IF NOT FOUND THEN
+			RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+				NULL::TIMESTAMP, NULL::TEXT[];
+		END IF;
+		RETURN;
+	END IF;
+
+	reviewers := ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id
+					   ORDER BY reviewer_id);
+
+	-- merge is idempotent, already merged pull request is returned as is
+	IF pr.status = 'OPEN' THEN
+		UPDATE pull_request SET status = 'MERGED', merged_at = p_merged_at
+		WHERE pull_request_id = p_pull_request_id
+		RETURNING * INTO pr;
+
+		-- merged pull request is not a part of reviewers load anymore
+		PERFORM 1 FROM "user" WHERE user_id = ANY(reviewers) ORDER BY user_id FOR NO KEY UPDATE;
+		UPDATE "user" SET open_reviews = open_reviews - 1 WHERE user_id = ANY(reviewers);
+	END IF;
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at, reviewers;
+END;
+$$;
+
+
+-- the candidate is chosen without a lock, then the candidate and the old reviewer are locked together
+-- in user_id order. concurrent reassigns may choose the same least loaded candidate, counters stay exact
+CREATE OR REPLACE FUNCTION reassign_pull_request(p_pull_request_id TEXT, p_old_user_id TEXT)
+RETURNS TABLE (
+	result TEXT,
+	pull_request_name TEXT,
+	author_id TEXT,
+	status pull_request_status_type,
+	created_at TIMESTAMP,
+	merged_at TIMESTAMP,
+	assigned_reviewers TEXT[],
+	replaced_by TEXT
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+	pr pull_request%ROWTYPE;
+	old_user_team_name TEXT;
+	candidate TEXT;
+BEGIN
+	SELECT * INTO pr FROM pull_request WHERE pull_request_id = p_pull_request_id FOR UPDATE;
+	SELECT team_name INTO old_user_team_name FROM "user" WHERE user_id = p_old_user_id;
+	IF old_user_team_name IS NOT NULL AND pr.pull_request_id IS NULL AND
+	   EXISTS (SELECT 1 FROM pull_request_archive a WHERE a.pull_request_id = p_pull_request_id) THEN
+		RETURN QUERY SELECT 'PR_MERGED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+	IF pr.pull_request_id IS NULL OR old_user_team_name IS NULL THEN
+		RETURN QUERY SELECT 'NOT_FOUND', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF pr.status = 'MERGED' THEN
+		RETURN QUERY SELECT 'PR_MERGED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	IF NOT EXISTS (SELECT 1 FROM "assignment"
+				   WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id) THEN
+		RETURN QUERY SELECT 'NOT_ASSIGNED', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type, NULL::TIMESTAMP,
+			NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+		RETURN;
+	END IF;
+
+	LOOP
+		-- the least loaded active teammate who is neither the author nor a reviewer of this pull request
+		SELECT user_id INTO candidate FROM "user" u
+		WHERE team_name = old_user_team_name AND is_active AND user_id <> pr.author_id AND
+			NOT EXISTS (SELECT 1 FROM "assignment" a
+						WHERE a.pull_request_id = p_pull_request_id AND a.reviewer_id = u.user_id)
+		ORDER BY open_reviews, user_id
+		LIMIT 1;
+
+		IF candidate IS NULL THEN
+			RETURN QUERY SELECT 'NO_CANDIDATE', NULL::TEXT, NULL::TEXT, NULL::pull_request_status_type,
+				NULL::TIMESTAMP, NULL::TIMESTAMP, NULL::TEXT[], NULL::TEXT;
+			RETURN;
+		END IF;
+
+		PERFORM 1 FROM "user" WHERE user_id IN (candidate, p_old_user_id) ORDER BY user_id FOR NO KEY UPDATE;
+		-- the candidate could be deactivated or moved to another team while the lock was awaited
+		EXIT WHEN EXISTS (SELECT 1 FROM "user"
+						  WHERE user_id = candidate AND team_name = old_user_team_name AND is_active);
+	END LOOP;
+
+	UPDATE "assignment" SET reviewer_id = candidate
+	WHERE pull_request_id = p_pull_request_id AND reviewer_id = p_old_user_id;
+
+	UPDATE "user" SET open_reviews = open_reviews + CASE WHEN user_id = candidate THEN 1 ELSE -1 END
+	WHERE user_id IN (candidate, p_old_user_id);
+
+	RETURN QUERY SELECT 'OK', pr.pull_request_name, pr.author_id, pr.status, pr.created_at, pr.merged_at,
+		ARRAY(SELECT reviewer_id FROM "assignment" WHERE pull_request_id = p_pull_request_id ORDER BY reviewer_id),
+		candidate;
+END;
+$$;
@@ -0,0 +1,104 @@
+import asyncio
+import os
+from pathlib import Path
+
+import psycopg
+import pytest
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+
+# tests run against a local postgres server, a database DB_TEST_NAME is created from scratch for the session.
+# settings are read before the service modules are imported, DB_NAME always points to the test database
+os.environ.setdefault('DB_HOST', 'localhost')
+os.environ.setdefault('DB_PORT', '5432')
+os.environ.setdefault('DB_USER', 'postgres')
+os.environ.setdefault('DB_PASSWORD', 'qwerty')
+os.environ.setdefault('APP_HOST', 'localhost')
+os.environ.setdefault('APP_PORT', '8080')
+os.environ['DB_NAME'] = os.getenv('DB_TEST_NAME', 'PR_assignment_test')
+# replica routing tests need a replica of the server, e.g. DB_TEST_READ_DSN="host=localhost port=5433",
+# the test database is created on the primary and reaches the replica by replication
+os.environ.pop('DB_READ_DSN', None)
+os.environ['ARCHIVE_INTERVAL'] = '0'
+os.environ['JOB_WORKERS'] = '0'
+
+from utils.migrations import apply_migrations  # noqa: E402
+
+DDL_PATH = Path(__file__).parents[2] / 'database' / 'pr_assignment_ddl.sql'
+TABLES = ['job', 'daily_throughput', 'author_merge_time', 'team_merge_time', 'assignment_archive',
+          'pull_request_archive', '"assignment"', 'pull_request', '"user"', 'team']
+
+
+def conninfo(dbname: str) -> str:
+    return make_conninfo(dbname=dbname, user=os.environ['DB_USER'], password=os.environ['DB_PASSWORD'],
+                         host=os.environ['DB_HOST'], port=os.environ['DB_PORT'])
+
+
+async def migrate(dsn: str):
+    async with await psycopg.AsyncConnection.connect(dsn, row_factory=dict_row) as connection:
+        await apply_migrations(connection)
+
+
+# the test database with the initial schema and all migrations applied
+@pytest.fixture(scope='session')
+def database() -> str:
+    try:
+        admin = psycopg.connect(conninfo('postgres'), autocommit=True, connect_timeout=3)
+    except psycopg.OperationalError as e:
+        pytest.skip(f'postgres is not available: {e}')
+    with admin:
+        admin.execute(f'DROP DATABASE IF EXISTS "{os.environ["DB_NAME"]}" WITH (FORCE)')
+        admin.execute(f'CREATE DATABASE "{os.environ["DB_NAME"]}"')
+    dsn = conninfo(os.environ['DB_NAME'])
+    with psycopg.connect(dsn) as connection:
+        connection.execute(DDL_PATH.read_text(encoding='utf-8'))
+    asyncio.run(migrate(dsn))
+    return dsn
+
+
+# connection to the test database, all data is removed after the test
+@pytest.fixture
+def db(database: str):
+    with psycopg.connect(database, row_factory=dict_row, autocommit=True) as connection:
+        yield connection
+        connection.execute(f'TRUNCATE {", ".join(TABLES)}')
+
+
+# the application with its pools opened on the test database, pools can't be reopened, so it's started once
+@pytest.fixture(scope='session')
+def application(database: str):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+# the application client, cached responses are dropped together with the data after the test
+@pytest.fixture
+def client(application, db):
+    from utils.cache import caches
+
+    yield application
+    for cache in caches.values():
+        cache.clear()
+
+
+def member(user_id: str, open_reviews: int, is_active: bool = True) -> dict:
+    return {'user_id': user_id, 'is_active': is_active, 'open_reviews': open_reviews}
+
+
+def pull_request(pull_request_id: str, author_id: str, reviewers: list[str]) -> dict:
+    return {'pull_request_id': pull_request_id, 'author_id': author_id, 'assigned_reviewers': reviewers}
+
+
+# members and open pull requests of a team to rebalance: moving u0's review of p00 to u1 and then u2's review
+# of p00 to u0 would assign u0 to p00 twice when the replacements are applied with one statement
+@pytest.fixture
+def swapped_reviews() -> tuple[list[dict], list[dict]]:
+    return [member('u0', 5), member('u1', 3), member('u2', 5), member('u3', 1)], [
+        pull_request('p00', 'u3', ['u2', 'u0']), pull_request('p01', 'u3', ['u1', 'u0']),
+        pull_request('p02', 'u3', ['u1', 'u2']), pull_request('p03', 'u3', ['u0', 'u2']),
+        pull_request('p04', 'u0', ['u2', 'u3']), pull_request('p05', 'u2', ['u1', 'u0']),
+        pull_request('p06', 'u3', ['u2', 'u0']),
+    ]
@@ -0,0 +1,47 @@
+import time
+
+import orjson
+import psycopg
+
+from utils.invalidation import PROCESS_ID
+
+
+# cache invalidation across processes (utils/invalidation.py)
+
+
+def import_team(client, username: str = 'first'):
+    response = client.post('/team/import', json=[
+        {'team_name': 'a', 'members': [{'user_id': 'u1', 'username': username, 'is_active': True}]}
+    ])
+    assert response.json()['results'][0]['status'] == 201
+
+
+def team_members(client) -> list:
+    return client.get('/team/get', params={'team_name': 'a'}).json()['members']
+
+
+def test_invalidation_is_sent_to_other_processes(client, database):
+    with psycopg.connect(database, autocommit=True) as listener:
+        listener.execute('LISTEN cache_invalidation')
+        import_team(client)
+        invalidations = [orjson.loads(notification.payload)
+                         for notification in listener.notifies(timeout=5, stop_after=1)]
+
+    assert invalidations == [{'process_id': PROCESS_ID, 'cache': 'team', 'keys': ['a']}]
+
+
+def test_invalidation_of_other_process_is_applied(client, db):
+    import_team(client)
+    assert team_members(client)[0]['username'] == 'first'
+
+    # a change made by another process is not seen until its invalidation arrives
+    db.execute('UPDATE "user" SET username = %s WHERE user_id = %s', ['second', 'u1'])
+    assert team_members(client)[0]['username'] == 'first'
+
+    db.execute('SELECT pg_notify(%s, %s)', ['cache_invalidation', orjson.dumps({
+        'process_id': 'other', 'cache': 'team', 'keys': ['a']
+    }).decode()])
+    deadline = time.monotonic() + 5
+    while team_members(client)[0]['username'] != 'second':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import psycopg
+import pytest
+from fastapi import Request
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import utils.db_queries
+from utils.db_queries import DatabaseSession, select_query, change_data_query, get_connection, \
+    get_read_only_connection
+
+
+# routing of DatabaseSession queries between the primary and the read replica. every query reports
+# where it was executed: pg_is_in_recovery() is true on the replica only
+
+RECOVERY_QUERY = 'SELECT pg_is_in_recovery() AS replica'
+# a write which changes nothing, it's enough to make the session sticky
+WRITE_QUERY = 'UPDATE team SET team_name = team_name WHERE FALSE'
+
+
+# the test database on the replica of the test server (DB_TEST_READ_DSN), it's created on the primary
+# and reaches the replica by replication
+@pytest.fixture(scope='session')
+def replica(database: str) -> str:
+    if not os.getenv('DB_TEST_READ_DSN'):
+        pytest.skip('DB_TEST_READ_DSN is not set')
+    dsn = make_conninfo(os.environ['DB_TEST_READ_DSN'], dbname=os.environ['DB_NAME'])
+    with psycopg.connect(database) as primary:
+        lsn = primary.execute('SELECT pg_current_wal_lsn()').fetchone()[0]
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with psycopg.connect(dsn) as connection:
+                if connection.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn', [lsn]).fetchone()[0]:
+                    return dsn
+        except psycopg.OperationalError:
+            pass
+        assert time.monotonic() < deadline, 'the replica has not caught up with the primary'
+        time.sleep(0.1)
+
+
+def open_pool(dsn: str) -> AsyncConnectionPool:
+    return AsyncConnectionPool(dsn, min_size=1, max_size=2, kwargs={'row_factory': dict_row}, open=False)
+
+
+# runs check(session factory) with the module pools replaced by pools of the test databases
+def run_with_pools(monkeypatch, primary_dsn: str, replica_dsn: str | None, check):
+    async def run():
+        primary_pool = open_pool(primary_dsn)
+        replica_pool = open_pool(replica_dsn) if replica_dsn else None
+        async with primary_pool:
+            monkeypatch.setattr(utils.db_queries, 'pool', primary_pool)
+            monkeypatch.setattr(utils.db_queries, 'replica_pool', replica_pool)
+            if replica_pool is None:
+                return await check()
+            async with replica_pool:
+                return await check()
+
+    return asyncio.run(run())
+
+
+async def on_replica(session: DatabaseSession) -> bool:
+    return (await select_query(session, RECOVERY_QUERY, return_one=True))['replica']
+
+
+def test_read_only_request_reads_from_replica(monkeypatch, database, replica):
+    async def check():
+        async with DatabaseSession(read_only=True) as session:
+            return [await on_replica(session), await on_replica(session), session.primary is None]
+
+    assert run_with_pools(monkeypatch, database, replica, check) == [True, True, True]
+
+
+def test_primary_reads_of_read_only_request(monkeypatch, database, replica):
+    async def check():
+        async with DatabaseSession(read_only=True) as session:
+            return (await select_query(session, RECOVERY_QUERY, return_one=True, primary=True))['replica']
+
+    assert run_with_pools(monkeypatch, database, replica, check) is False
+
+
+def test_write_request_uses_primary(monkeypatch, database, replica):
+    async def check():
+        async with DatabaseSession(read_only=False) as session:
+            read = await on_replica(session)
+            await change_data_query(session, WRITE_QUERY, {})
+            cursor = await (await session.writer()).execute(RECOVERY_QUERY)
+            return [read, (await cursor.fetchone())['replica'], session.replica is None]
+
+    assert run_with_pools(monkeypatch, database, replica, check) == [False, False, True]
+
+
+def test_reads_stick_to_primary_after_write(monkeypatch, database, replica):
+    async def check():
+        async with DatabaseSession(read_only=True) as session:
+            before = await on_replica(session)
+            await change_data_query(session, WRITE_QUERY, {})
+            return [before, await on_replica(session)]
+
+    assert run_with_pools(monkeypatch, database, replica, check) == [True, False]
+
+
+def test_reads_stick_to_primary_after_commit(monkeypatch, database, replica):
+    async def check():
+        async with DatabaseSession(read_only=True) as session:
+            await change_data_query(session, WRITE_QUERY, {})
+            await session.commit()
+            return await on_replica(session)
+
+    assert run_with_pools(monkeypatch, database, replica, check) is False
+
+
+# POST requests go to the primary, except routes which only read and use get_read_only_connection
+def test_read_only_post_route_reads_from_replica(monkeypatch, database, replica):
+    async def read(dependency) -> bool:
+        request = Request({'type': 'http', 'method': 'POST', 'route': SimpleNamespace(path='/pullRequest/getMany')})
+        sessions = dependency(request)
+        try:
+            return await on_replica(await anext(sessions))
+        finally:
+            await sessions.aclose()
+
+    async def check():
+        return [await read(get_connection), await read(get_read_only_connection)]
+
+    assert run_with_pools(monkeypatch, database, replica, check) == [False, True]
+
+
+# runs without a replica too
+def test_everything_goes_to_primary_without_replica(monkeypatch, database):
+    async def check():
+        async with DatabaseSession(read_only=True) as session:
+            read = await on_replica(session)
+            await change_data_query(session, WRITE_QUERY, {})
+            return [read, await on_replica(session), session.replica is None]
+
+    assert run_with_pools(monkeypatch, database, None, check) == [False, False, True]
@@ -0,0 +1,59 @@
+import psycopg
+import pytest
+
+from api.pull_request import PULL_REQUESTS_BY_ID_QUERY
+from api.statistics import TEAM_REVIEWER_LOAD_QUERY
+from api.team import TEAM_PAGE_QUERY
+from api.users import REVIEW_QUERY, REVIEWS_QUERY
+from utils.reviewer_selection import PICK_REVIEWERS_QUERY, DEACTIVATED_REVIEWS_QUERY
+
+
+# query plans of the hot path queries (migrations/0001, 0002, 0004): tables of the test database are tiny,
+# so sequential scans are disabled and the test checks which index the planner picks for every query
+QUERIES = {
+    'get_review': (REVIEW_QUERY, {'user_id': 't1_u1'}, ['assignment_reviewer_idx']),
+    'get_review_many': (REVIEWS_QUERY, {'user_ids': ['t1_u1', 't2_u2']}, ['assignment_reviewer_idx']),
+    'pick_reviewers': (PICK_REVIEWERS_QUERY, {'team_name': 't1', 'excluded_users': ['t1_u0'], 'amount': 2},
+                       ['user_team_load_idx']),
+    'deactivated_reviews': (DEACTIVATED_REVIEWS_QUERY, {'users': ['t1_u1', 't1_u2']}, ['assignment_reviewer_idx']),
+    'team_page': (TEAM_PAGE_QUERY, {'team_name': 't1', 'after': 't1_u10', 'limit': 10},
+                  ['user_team_name_user_id_idx']),
+    'reviewer_load_team': (TEAM_REVIEWER_LOAD_QUERY, {'team_name': 't1', 'after': None, 'limit': 10},
+                           ['user_team_name_user_id_idx']),
+    'pull_requests_by_id': (PULL_REQUESTS_BY_ID_QUERY, {'pull_request_ids': ['pr1', 'pr2']},
+                            ['pull_request_pkey', 'pull_request_archive_default_pull_request_id_idx']),
+}
+
+
+@pytest.fixture(scope='module')
+def seeded(database):
+    with psycopg.connect(database, autocommit=True) as connection:
+        connection.execute('''
+                           INSERT INTO team SELECT 't' || n FROM generate_series(0, 19) n;
+                           INSERT INTO "user" (user_id, username, team_name, is_active, open_reviews)
+                           SELECT 't' || t || '_u' || n, 'user', 't' || t, n % 10 <> 0, n % 7
+                           FROM generate_series(0, 19) t, generate_series(0, 49) n;
+                           INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status,
+                                                     created_at, reviewers_amount)
+                           SELECT 'pr' || n, 'pr', 't' || n % 20 || '_u' || n % 50,
+                               (CASE WHEN n % 2 = 0 THEN 'OPEN' ELSE 'MERGED' END)::pull_request_status_type,
+                               now(), 2
+                           FROM generate_series(0, 1999) n;
+                           INSERT INTO "assignment" (pull_request_id, reviewer_id)
+                           SELECT 'pr' || n, 't' || n % 20 || '_u' || (n + r) % 50
+                           FROM generate_series(0, 1999) n, generate_series(1, 2) r;
+                           ANALYZE;
+                           ''')
+    yield database
+    with psycopg.connect(database, autocommit=True) as connection:
+        connection.execute('TRUNCATE "assignment", pull_request, "user", team CASCADE')
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_uses_index(seeded, name):
+    query, parameters, indexes = QUERIES[name]
+    with psycopg.connect(seeded) as connection:
+        connection.execute('SET enable_seqscan = off')
+        plan = '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + query, parameters).fetchall())
+    for index in indexes:
+        assert index in plan, plan
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import psycopg
+from psycopg.rows import dict_row
+
+from utils.reviewer_selection import update_reviewers_load
+
+
+# /pullRequest/reassign
+
+
+def seed_swapped_reviews(db):
+    db.execute('''
+               INSERT INTO team VALUES ('t');
+               INSERT INTO "user" (user_id, username, team_name, is_active, open_reviews)
+               VALUES ('author', 'author', 't', TRUE, 0), ('a', 'a', 't', TRUE, 1), ('b', 'b', 't', TRUE, 1);
+               INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at,
+                                         reviewers_amount)
+               VALUES ('pr1', 'pr1', 'author', 'OPEN', now(), 1), ('pr2', 'pr2', 'author', 'OPEN', now(), 1);
+               INSERT INTO "assignment" (pull_request_id, reviewer_id) VALUES ('pr1', 'a'), ('pr2', 'b');
+               ''')
+
+
+# every reassign moves a review to the only other teammate, so the two threads always swap the same two users
+def test_swapped_reassigns_do_not_deadlock(database, db):
+    seed_swapped_reviews(db)
+    errors = []
+
+    def reassign(pull_request_id: str):
+        try:
+            with psycopg.connect(database) as connection:
+                for _ in range(1000):
+                    old_user_id = connection.execute('''
+                                                     SELECT reviewer_id FROM "assignment"
+                                                     WHERE pull_request_id = %s
+                                                     ''', [pull_request_id]).fetchone()[0]
+                    result = connection.execute('SELECT result FROM reassign_pull_request(%s, %s)',
+                                                [pull_request_id, old_user_id]).fetchone()[0]
+                    connection.commit()
+                    assert result == 'OK', result
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reassign, args=(pull_request_id,)) for pull_request_id in ('pr1', 'pr2')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert db.execute('SELECT user_id, open_reviews FROM "user" ORDER BY user_id').fetchall() == [
+        {'user_id': 'a', 'open_reviews': 1}, {'user_id': 'author', 'open_reviews': 0},
+        {'user_id': 'b', 'open_reviews': 1}
+    ]
+
+
+
+# /pullRequest/create, /pullRequest/createMany, /team/rebalance
+
+
+# creates of one team wait for each other on their daily_throughput rollup row, so the test interleaves
+# what these handlers do after it: assignments of the same reviewers are inserted by both transactions
+# (their foreign key checks take KEY SHARE locks on the users) and then the reviewers load is updated
+def test_concurrent_assignments_of_same_reviewers_do_not_deadlock(database, db):
+    db.execute('''
+               INSERT INTO team VALUES ('t');
+               INSERT INTO "user" (user_id, username, team_name, is_active)
+               VALUES ('author', 'author', 't', TRUE), ('a', 'a', 't', TRUE), ('b', 'b', 't', TRUE);
+               INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at,
+                                         reviewers_amount)
+               VALUES ('pr1', 'pr1', 'author', 'OPEN', now(), 2), ('pr2', 'pr2', 'author', 'OPEN', now(), 2);
+               ''')
+
+    async def assign(connection: psycopg.AsyncConnection, pull_request_id: str, reviewers: list[str]):
+        for reviewer in reviewers:
+            await connection.execute('INSERT INTO "assignment" (pull_request_id, reviewer_id) VALUES (%s, %s)',
+                                     [pull_request_id, reviewer])
+
+    async def update_load(connection: psycopg.AsyncConnection):
+        await update_reviewers_load(connection, {'a': 1, 'b': 1})
+        await connection.commit()
+
+    async def run():
+        async with await psycopg.AsyncConnection.connect(database, row_factory=dict_row) as first, \
+                await psycopg.AsyncConnection.connect(database, row_factory=dict_row) as second:
+            await assign(first, 'pr1', ['a', 'b'])
+            await assign(second, 'pr2', ['b', 'a'])
+            await asyncio.gather(update_load(first), update_load(second))
+
+    asyncio.run(run())
+    assert db.execute('SELECT user_id, open_reviews FROM "user" ORDER BY user_id').fetchall() == [
+        {'user_id': 'a', 'open_reviews': 2}, {'user_id': 'author', 'open_reviews': 0},
+        {'user_id': 'b', 'open_reviews': 2}
+    ]
@@ -0,0 +1,61 @@
+from tests.conftest import member, pull_request
+from utils.reviewer_selection import plan_rebalance
+
+
+# plan_rebalance
+
+
+def original_reviewers(pull_requests: list[dict]) -> dict:
+    return {pr['pull_request_id']: set(pr['assigned_reviewers']) for pr in pull_requests}
+
+
+def test_review_is_not_moved_to_original_reviewer(swapped_reviews):
+    members, pull_requests = swapped_reviews
+    reviewers = original_reviewers(pull_requests)
+    replacements, load_changes = plan_rebalance(members, pull_requests)
+
+    assert replacements == [('p00', 'u0', 'u1'), ('p02', 'u2', 'u0'), ('p05', 'u0', 'u3')]
+    assert all(new_reviewer not in reviewers[pull_request_id] for pull_request_id, _, new_reviewer in replacements)
+    assert load_changes == {'u0': -1, 'u1': 1, 'u2': -1, 'u3': 1}
+
+
+def test_review_is_not_given_to_author():
+    replacements, load_changes = plan_rebalance(
+        [member('u0', 4), member('u1', 0), member('u2', 0)],
+        [pull_request(f'p{number}', 'u1', ['u0']) for number in range(4)]
+    )
+
+    assert all(new_reviewer == 'u2' for _, _, new_reviewer in replacements)
+    assert load_changes == {'u0': -2, 'u2': 2}
+
+
+def test_reviews_of_inactive_members_go_to_active_ones():
+    replacements, load_changes = plan_rebalance(
+        [member('u0', 2, is_active=False), member('u1', 0), member('u2', 2), member('u3', 0),
+         member('u4', 0, is_active=False)],
+        [pull_request('p0', 'u1', ['u0', 'u2']), pull_request('p1', 'u1', ['u0', 'u2'])]
+    )
+
+    # u1 is the author and u2 already reviews both pull requests, inactive u4 never gets a review
+    assert replacements == [('p0', 'u0', 'u3'), ('p1', 'u0', 'u3')]
+    assert load_changes == {'u0': -2, 'u3': 2}
+
+
+def test_review_without_candidate_stays():
+    replacements, load_changes = plan_rebalance(
+        [member('u0', 1, is_active=False), member('u1', 0)],
+        [pull_request('p0', 'u1', ['u0'])]
+    )
+
+    assert replacements == []
+    assert load_changes == {}
+
+
+def test_balanced_team_has_no_moves():
+    replacements, load_changes = plan_rebalance(
+        [member('u0', 1), member('u1', 1), member('u2', 0)],
+        [pull_request('p0', 'u2', ['u0', 'u1'])]
+    )
+
+    assert replacements == []
+    assert load_changes == {}
@@ -0,0 +1,87 @@
+from tests.conftest import member, pull_request
+
+
+# /team/import
+
+
+def test_import_duplicate_team_name_keeps_first_members(client, db):
+    response = client.post('/team/import', json=[
+        {'team_name': 'a', 'members': [{'user_id': 'u1', 'username': 'first', 'is_active': True}]},
+        {'team_name': 'a', 'members': [{'user_id': 'u2', 'username': 'second', 'is_active': True}]},
+    ])
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [result['status'] for result in results] == [201, 400]
+    assert results[0]['team']['members'][0]['user_id'] == 'u1'
+    assert results[1]['error']['code'] == 'TEAM_EXISTS'
+
+    assert db.execute('SELECT user_id, team_name FROM "user" ORDER BY user_id').fetchall() == [
+        {'user_id': 'u1', 'team_name': 'a'}
+    ]
+    assert client.get('/team/get', params={'team_name': 'a'}).json()['members'] == [
+        {'user_id': 'u1', 'username': 'first', 'is_active': True}
+    ]
+
+
+def test_import_rejected_team_does_not_overwrite_member(client, db):
+    response = client.post('/team/import', json=[
+        {'team_name': 'a', 'members': [{'user_id': 'u1', 'username': 'first', 'is_active': True}]},
+        {'team_name': 'a', 'members': [{'user_id': 'u1', 'username': 'second', 'is_active': False}]},
+    ])
+    assert [result['status'] for result in response.json()['results']] == [201, 400]
+    assert db.execute('SELECT username, is_active FROM "user" WHERE user_id = %s', ['u1']).fetchone() == {
+        'username': 'first', 'is_active': True
+    }
+
+
+# /team/rebalance
+
+
+def seed_team(db, members: list[dict], pull_requests: list[dict]):
+    db.execute("INSERT INTO team VALUES ('t')")
+    for member in members:
+        db.execute('INSERT INTO "user" (user_id, username, team_name, is_active, open_reviews) '
+                   'VALUES (%s, %s, %s, %s, %s)',
+                   [member['user_id'], member['user_id'], 't', member['is_active'], member['open_reviews']])
+    for pr in pull_requests:
+        db.execute('INSERT INTO pull_request (pull_request_id, pull_request_name, author_id, status, created_at, '
+                   "reviewers_amount) VALUES (%s, %s, %s, 'OPEN', now(), 2)",
+                   [pr['pull_request_id'], pr['pull_request_id'], pr['author_id']])
+        for reviewer in pr['assigned_reviewers']:
+            db.execute('INSERT INTO "assignment" (pull_request_id, reviewer_id) VALUES (%s, %s)',
+                       [pr['pull_request_id'], reviewer])
+
+
+def test_rebalance_applies_moves_of_the_same_pull_request(client, db, swapped_reviews):
+    seed_team(db, *swapped_reviews)
+
+    response = client.post('/team/rebalance', json={'team_name': 't'})
+    assert response.status_code == 200, response.text
+    assert response.json()['load_after'] == {'u0': 4, 'u1': 4, 'u2': 4, 'u3': 2}
+
+    # counters match the assignments after the moves
+    assert db.execute('''
+                      SELECT u.user_id, u.open_reviews, COUNT(a.assignment_id) AS reviews FROM "user" u
+                      LEFT JOIN "assignment" a ON a.reviewer_id = u.user_id
+                      GROUP BY u.user_id ORDER BY u.user_id
+                      ''').fetchall() == [
+        {'user_id': 'u0', 'open_reviews': 4, 'reviews': 4}, {'user_id': 'u1', 'open_reviews': 4, 'reviews': 4},
+        {'user_id': 'u2', 'open_reviews': 4, 'reviews': 4}, {'user_id': 'u3', 'open_reviews': 2, 'reviews': 2},
+    ]
+
+
+# u0 gives the review of p1 to u3 and gets the review of p0 from u1, its load doesn't change but its review does
+def test_rebalance_invalidates_reviews_of_members_without_load_change(client, db):
+    seed_team(db, [member('u0', 1), member('u1', 3), member('u2', 2), member('u3', 0)], [
+        pull_request('p0', 'u3', ['u1', 'u2']), pull_request('p1', 'u2', ['u1', 'u0']),
+        pull_request('p2', 'u0', ['u2', 'u1']),
+    ])
+    assert [pr['pull_request_id'] for pr in client.get('/users/getReview', params={'user_id': 'u0'}).json()[
+        'members']] == ['p1']
+
+    response = client.post('/team/rebalance', json={'team_name': 't'})
+    assert response.status_code == 200, response.text
+    assert response.json()['load_after']['u0'] == 1
+
+    assert [pr['pull_request_id'] for pr in client.get('/users/getReview', params={'user_id': 'u0'}).json()[
+        'members']] == ['p0']
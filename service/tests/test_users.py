@@ -0,0 +1,8 @@
+# /users/deactivateMany
+
+
+def test_deactivate_many_without_users(client):
+    for background in (False, True):
+        response = client.post('/users/deactivateMany', params={'background': background}, json={'users': []})
+        assert response.status_code == 200
+        assert response.json() == {'reassignments': {}}
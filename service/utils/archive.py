@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+
+from psycopg import AsyncConnection
+
+from connection import pool
+from variables import ARCHIVE_MERGED_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL
+
+
+logger = logging.getLogger('archive')
+
+
+# moves pull requests merged before merged_before with their assignments to the archive tables
+# (see archive_merged_pull_requests in migrations/0007_pull_request_archive.sql), returns their amount.
+# every batch is a separate transaction, so rows are locked shortly and requests aren't blocked for long
+async def archive_merged_pull_requests(connection: AsyncConnection, merged_before: datetime,
+                                       batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    archived = 0
+    while True:
+        cursor = await connection.execute('SELECT archive_merged_pull_requests(%(merged_before)s, %(batch_size)s) '
+                                          'AS archived', {'merged_before': merged_before, 'batch_size': batch_size})
+        batch = (await cursor.fetchone())['archived']
+        await connection.commit()
+        archived += batch
+        if batch < batch_size:
+            return archived
+
+
+def archive_cutoff(merged_after_days: float = ARCHIVE_MERGED_AFTER_DAYS) -> datetime:
+    return datetime.now() - timedelta(days=merged_after_days)
+
+
+# started on application startup (see lifespan in main.py) and cancelled on shutdown,
+# errors are logged and the archival is retried on the next run
+async def run_periodic_archival():
+    while True:
+        try:
+            async with pool.connection() as connection:
+                archived = await archive_merged_pull_requests(connection, archive_cutoff())
+            if archived:
+                logger.info('archived %d merged pull requests', archived)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('archival of merged pull requests failed')
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+async def main():
+    # days can be passed as an argument, e.g. 0 archives all merged pull requests
+    merged_after_days = float(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_MERGED_AFTER_DAYS
+    await pool.open(wait=True)
+    try:
+        async with pool.connection() as connection:
+            archived = await archive_merged_pull_requests(connection, archive_cutoff(merged_after_days))
+    finally:
+        await pool.close()
+    print(f'Archived merged pull requests: {archived}')
+
+
+# python -m utils.archive [days]
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Awaitable, Callable, Hashable
+
+from variables import CACHE_MAX_SIZE, CACHE_TTL, COALESCE_TTL
+
+
+# the loading request was cancelled (e.g. its client disconnected), requests waiting for it load again
+class LoadCancelledError(Exception):
+    pass
+
+
+# caches by name and keys invalidated by this process by cache name. run_invalidation_publisher
+# (utils/invalidation.py) sends the keys to other processes, so their caches don't serve changed data
+caches = {}
+pending_invalidations = {}
+invalidations_pending = asyncio.Event()
+
+
+# bounded in-process LRU cache with time to live for read endpoints responses.
+# entries are invalidated by the handlers that change cached data right after their commit, in this process
+# at once and in other worker processes and service instances when the invalidation reaches them (see
+# utils/invalidation.py). TTL bounds staleness if invalidations are lost, e.g. while the listener reconnects.
+# get_or_load coalesces concurrent misses of the same key: one request loads the value (single flight),
+# the others wait for it and share the result instead of running the same query
+class TTLCache:
+    def __init__(self, name: str, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # loads in flight by key
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        caches[name] = self
+
+    def get(self, key: Hashable):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value):
+        # ttl 0 - only concurrent requests share loaded values
+        if self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # keys invalidated by other processes are not sent further (broadcast=False)
+    def invalidate(self, keys, broadcast: bool = True):
+        keys = set(keys)
+        for key in keys:
+            self.entries.pop(key, None)
+            # a load started before the change is neither cached nor shared with later requests
+            self.loading.pop(key, None)
+        if broadcast and keys:
+            pending_invalidations.setdefault(self.name, set()).update(keys)
+            invalidations_pending.set()
+
+    def clear(self):
+        self.entries.clear()
+        self.loading.clear()
+
+    # load returns the value or None for values which are not cached (e.g. not found)
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable]):
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            loaded = self.loading.get(key)
+            if loaded is None:
+                break
+            self.coalesced += 1
+            try:
+                # a cancelled waiter must not cancel the shared load
+                return await asyncio.shield(loaded)
+            except LoadCancelledError:
+                continue
+
+        loaded = asyncio.get_running_loop().create_future()
+        self.loading[key] = loaded
+        try:
+            value = await load()
+        except BaseException as e:
+            if self.loading.get(key) is loaded:
+                del self.loading[key]
+            loaded.set_exception(LoadCancelledError() if isinstance(e, asyncio.CancelledError) else e)
+            # the exception is raised here, it's not an error if no request was waiting for it
+            loaded.exception()
+            raise
+        if self.loading.get(key) is loaded:
+            del self.loading[key]
+            if value is not None:
+                self.set(key, value)
+        loaded.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.entries), 'max_size': self.max_size, 'ttl': self.ttl,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'coalesced': self.coalesced,
+            'hit_ratio': self.hits / requests if requests else None
+        }
+
+
+# concurrent calls of a read endpoint with the same parameters share one call and its response.
+# the response is rendered once and sent to every waiting client, it's reused for cache.ttl seconds after that.
+# skip(parameters) excludes calls which can't be shared, e.g. streaming responses
+def coalesced(cache: TTLCache, skip: Callable[[dict], bool] = lambda parameters: False):
+    def decorator(endpoint):
+        # FastAPI reads parameters and dependencies from the signature of the wrapped endpoint
+        @wraps(endpoint)
+        async def wrapper(**parameters):
+            if skip(parameters):
+                return await endpoint(**parameters)
+            key = (endpoint.__name__, *sorted((name, value) for name, value in parameters.items()
+                                              if name != 'connection'))
+            return await cache.get_or_load(key, lambda: endpoint(**parameters))
+        return wrapper
+    return decorator
+
+
+# /team/get responses by team_name
+team_cache = TTLCache('team')
+# /users/getReview responses by user_id
+review_cache = TTLCache('review')
+# statistics responses by endpoint and parameters, COALESCE_TTL is a micro-TTL (0 - concurrent requests only)
+statistics_cache = TTLCache('statistics', ttl=COALESCE_TTL)
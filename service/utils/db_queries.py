@@ -1,19 +1,116 @@
-from psycopg2.extras import RealDictCursor
+import time
+from contextlib import AsyncExitStack
+from typing import AsyncIterator
 
-from connection import connection
+from psycopg import AsyncConnection
+from fastapi import Request
+from psycopg.rows import RowFactory
 
+from connection import pool, replica_pool
+from utils.metrics import record_query, set_request_route
 
-def select_query(query: str, parameters: dict = {}, return_one: bool = False) -> tuple | None:
-    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute(query, parameters)
+
+# database access of one request, it's passed to handlers instead of a connection.
+# connections are checked out of the pools lazily, on the first query that needs them:
+# - change_data_query goes to the primary and makes the session sticky: all later queries of the request,
+#   reads after commit included, go to the primary and see written data
+# - select_query goes to the replica only in read-only requests (GET and get_read_only_connection routes)
+#   which haven't touched the primary.
+#   write requests read the data they change in the same transaction, so they read from the primary
+#   (stale replica rows would break duplicate checks and reviewers load counters)
+# without DB_READ_DSN every query goes to the primary
+class DatabaseSession:
+    def __init__(self, read_only: bool):
+        self.sticky = not read_only or replica_pool is None
+        self.primary = None
+        self.replica = None
+        self.exit_stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.exit_stack.__aexit__(*exc_info)
+
+    async def writer(self) -> AsyncConnection:
+        if self.primary is None:
+            self.primary = await self.exit_stack.enter_async_context(pool.connection())
+        self.sticky = True
+        return self.primary
+
+    async def reader(self) -> AsyncConnection:
+        if self.sticky:
+            return await self.writer()
+        if self.replica is None:
+            self.replica = await self.exit_stack.enter_async_context(replica_pool.connection())
+        return self.replica
+
+    async def commit(self):
+        for connection in (self.primary, self.replica):
+            if connection is not None:
+                await connection.commit()
+        # read-your-writes: the rest of the request reads committed data from the primary
+        if self.primary is not None:
+            self.sticky = True
+
+    async def rollback(self):
+        for connection in (self.primary, self.replica):
+            if connection is not None:
+                await connection.rollback()
+
+
+# helpers accept a session or a plain connection (e.g. in benchmarks and scripts)
+async def reader(connection: DatabaseSession | AsyncConnection) -> AsyncConnection:
+    return await connection.reader() if isinstance(connection, DatabaseSession) else connection
+
+
+async def writer(connection: DatabaseSession | AsyncConnection) -> AsyncConnection:
+    return await connection.writer() if isinstance(connection, DatabaseSession) else connection
+
+
+# FastAPI dependency: every request gets its own session, its connections are returned to the pools
+# after the response is sent
+async def get_connection(request: Request) -> AsyncIterator[DatabaseSession]:
+    set_request_route(request.scope['route'].path)
+    async with DatabaseSession(read_only=request.method in ('GET', 'HEAD')) as session:
+        yield session
+
+
+# POST routes which only read, e.g. batch lookups with ids in the request body, use it instead of get_connection,
+# so their reads go to the replica like reads of GET requests
+async def get_read_only_connection(request: Request) -> AsyncIterator[DatabaseSession]:
+    set_request_route(request.scope['route'].path)
+    async with DatabaseSession(read_only=True) as session:
+        yield session
+
+
+# hot path queries are called with prepare=True: they are prepared on the first call and then executed by
+# statement name, skipping parsing and planning. prepared statements are kept per connection in a bounded LRU
+# cache (DB_PREPARED_MAX), other queries are prepared after DB_PREPARE_THRESHOLD executions (prepare=None)
+
+# rows are dicts by default, row_factory (e.g. psycopg.rows.class_row) maps them to compact records instead.
+# primary=True reads from the primary in read-only requests too, e.g. to fill caches with data that isn't behind
+async def select_query(connection: DatabaseSession | AsyncConnection, query: str, parameters: dict = {},
+                       return_one: bool = False, row_factory: RowFactory | None = None,
+                       prepare: bool | None = None, primary: bool = False) -> list | dict | None:
+    started = time.perf_counter()
+    connection = await (writer if primary else reader)(connection)
+    async with connection.cursor(**({'row_factory': row_factory} if row_factory else {})) as cursor:
+        await cursor.execute(query, parameters, prepare=prepare)
         if cursor.rowcount == 0:
+            record_query('select', query, started, 0)
             return None
         else:
-            result = cursor.fetchone() if return_one else cursor.fetchall()
+            result = await cursor.fetchone() if return_one else await cursor.fetchall()
+    record_query('select', query, started, 1 if return_one else len(result))
     return result
 
 
-def change_data_query(query: str, parameters: dict) -> bool:
-    with connection.cursor() as cursor:
-        cursor.execute(query, parameters)
+async def change_data_query(connection: DatabaseSession | AsyncConnection, query: str, parameters: dict,
+                            prepare: bool | None = None) -> bool:
+    started = time.perf_counter()
+    connection = await writer(connection)
+    async with connection.cursor() as cursor:
+        await cursor.execute(query, parameters, prepare=prepare)
+        record_query('change', query, started, max(cursor.rowcount, 0))
         return True if cursor.rowcount >= 1 else False
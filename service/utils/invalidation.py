@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from uuid import uuid4
+
+import orjson
+from psycopg import AsyncConnection
+
+from connection import pool
+from utils.cache import caches, pending_invalidations, invalidations_pending
+from utils.responses import dumps
+from variables import CACHE_INVALIDATION_RETRY_INTERVAL
+
+
+# caches of every worker process and service instance are invalidated together: keys invalidated by a process
+# after its commit are sent with NOTIFY on the primary database, all processes LISTEN to the channel and drop
+# the same keys from their caches. a notification reaches other processes milliseconds after the commit,
+# a request served by another process in between may get the cached data from before the change
+
+logger = logging.getLogger('invalidation')
+
+CHANNEL = 'cache_invalidation'
+# notifications of this process are skipped by its own listener, its caches are already invalidated
+PROCESS_ID = str(uuid4())
+# notification payload is limited to 8000 bytes, keys are sent in chunks
+KEYS_PER_NOTIFICATION = 100
+
+
+# started on application startup (see lifespan in main.py) and cancelled on shutdown. invalidations of many
+# requests are sent together in one transaction, unsent ones are kept and sent with the next try
+async def run_invalidation_publisher():
+    while True:
+        await invalidations_pending.wait()
+        invalidations_pending.clear()
+        invalidations = dict(pending_invalidations)
+        pending_invalidations.clear()
+        try:
+            async with pool.connection() as connection:
+                for name, keys in invalidations.items():
+                    keys = list(keys)
+                    for offset in range(0, len(keys), KEYS_PER_NOTIFICATION):
+                        await connection.execute('SELECT pg_notify(%(channel)s, %(payload)s)', {
+                            'channel': CHANNEL, 'payload': dumps({
+                                'process_id': PROCESS_ID, 'cache': name,
+                                'keys': keys[offset:offset + KEYS_PER_NOTIFICATION]
+                            }).decode()})
+                await connection.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('cache invalidation publishing failed')
+            for name, keys in invalidations.items():
+                pending_invalidations.setdefault(name, set()).update(keys)
+            invalidations_pending.set()
+            await asyncio.sleep(CACHE_INVALIDATION_RETRY_INTERVAL)
+
+
+# started on application startup with its own connection, the pooled ones are returned between requests.
+# notifications sent while the connection was lost are missed, so all caches are cleared on every (re)connect
+async def run_invalidation_listener():
+    while True:
+        try:
+            async with await AsyncConnection.connect(pool.conninfo, autocommit=True) as connection:
+                await connection.execute(f'LISTEN {CHANNEL}')
+                for cache in caches.values():
+                    cache.clear()
+                async for notification in connection.notifies():
+                    invalidation = orjson.loads(notification.payload)
+                    if invalidation['process_id'] != PROCESS_ID and invalidation['cache'] in caches:
+                        caches[invalidation['cache']].invalidate(invalidation['keys'], broadcast=False)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('cache invalidation listener failed')
+        await asyncio.sleep(CACHE_INVALIDATION_RETRY_INTERVAL)
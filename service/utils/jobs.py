@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from uuid import uuid4
+
+from psycopg import AsyncConnection
+from psycopg.types.json import Jsonb
+
+from connection import pool
+from utils.db_queries import DatabaseSession, select_query, change_data_query
+from utils.responses import dumps
+from utils.cache import team_cache, review_cache
+from utils.reviewer_selection import lock_users, reassign_deactivated_reviewers
+from variables import JOB_BATCH_SIZE, JOB_POLL_INTERVAL, JOB_LEASE_TIMEOUT, JOB_MAX_ATTEMPTS
+
+
+# postgres-backed queue of background jobs (job table, migrations/0008_job_queue.sql): bulk endpoints enqueue
+# a job and return its id, run_job_worker tasks of every process claim jobs and run their handlers.
+# a handler works in batches, every batch is committed together with the job progress and its partial results,
+# so the job can be resumed from the last checkpoint by another worker and /jobs/{job_id} shows the progress
+
+logger = logging.getLogger('jobs')
+
+DEACTIVATE_USERS_JOB = 'deactivate_users'
+
+# set when a job is enqueued by this process, so its workers don't wait for the next poll
+jobs_enqueued = asyncio.Event()
+
+
+# the job was claimed again by another worker after its lease had expired, this worker must stop
+class JobLeaseLostError(RuntimeError):
+    pass
+
+
+# not committed here, the job becomes visible to workers with the commit of the request
+async def enqueue_job(connection: DatabaseSession | AsyncConnection, kind: str, payload: dict,
+                      progress: dict) -> str:
+    job_id = str(uuid4())
+    await change_data_query(connection, '''
+                            INSERT INTO job (job_id, kind, payload, progress)
+                            VALUES (%(job_id)s, %(kind)s, %(payload)s, %(progress)s)
+                            ''', {'job_id': job_id, 'kind': kind, 'payload': Jsonb(payload, dumps=dumps),
+                                  'progress': Jsonb(progress, dumps=dumps)})
+    return job_id
+
+
+async def claim_job(connection: AsyncConnection) -> dict | None:
+    # jobs which have lost their workers too many times are failed instead of being claimed again
+    await change_data_query(connection, '''
+                            UPDATE job SET status = 'FAILED', error = 'worker lease expired', finished_at = now()
+                            WHERE status = 'RUNNING' AND attempts >= %(max_attempts)s AND
+                                heartbeat_at < now() - make_interval(secs => %(lease_timeout)s)
+                            ''', {'max_attempts': JOB_MAX_ATTEMPTS, 'lease_timeout': JOB_LEASE_TIMEOUT})
+    job = await select_query(connection, '''
+                             UPDATE job SET status = 'RUNNING', attempts = attempts + 1,
+                                 started_at = coalesce(started_at, now()), heartbeat_at = now()
+                             WHERE job_id = (
+                                 SELECT job_id FROM job
+                                 WHERE status = 'QUEUED' OR (status = 'RUNNING' AND
+                                     heartbeat_at < now() - make_interval(secs => %(lease_timeout)s))
+                                 ORDER BY created_at
+                                 LIMIT 1
+                                 FOR UPDATE SKIP LOCKED
+                             )
+                             RETURNING job_id, kind, payload, progress, attempts
+                             ''', {'lease_timeout': JOB_LEASE_TIMEOUT}, return_one=True, prepare=True)
+    await connection.commit()
+    return job
+
+
+# commits the current batch of the job together with its progress, result is merged into the job result
+async def save_job_progress(connection: AsyncConnection, job: dict, progress: dict, result: dict | None = None):
+    if not await change_data_query(connection, '''
+                                   UPDATE job SET progress = %(progress)s, result = result || %(result)s,
+                                       heartbeat_at = now()
+                                   WHERE job_id = %(job_id)s AND attempts = %(attempts)s AND status = 'RUNNING'
+                                   ''', {'job_id': job['job_id'], 'attempts': job['attempts'],
+                                         'progress': Jsonb(progress, dumps=dumps),
+                                         'result': Jsonb(result or {}, dumps=dumps)}, prepare=True):
+        raise JobLeaseLostError(job['job_id'])
+    await connection.commit()
+    job['progress'] = progress
+
+
+async def finish_job(connection: AsyncConnection, job: dict, status: str, error: str | None = None):
+    await change_data_query(connection, '''
+                            UPDATE job SET status = %(status)s, error = %(error)s, finished_at = now()
+                            WHERE job_id = %(job_id)s AND attempts = %(attempts)s AND status = 'RUNNING'
+                            ''', {'job_id': job['job_id'], 'attempts': job['attempts'], 'status': status,
+                                  'error': error})
+    await connection.commit()
+
+
+async def run_job(connection: AsyncConnection, job: dict):
+    if job['kind'] not in JOB_HANDLERS:
+        await finish_job(connection, job, 'FAILED', f"unknown job kind {job['kind']}")
+        return
+    try:
+        await JOB_HANDLERS[job['kind']](connection, job)
+    except JobLeaseLostError:
+        await connection.rollback()
+        logger.warning('job %s was taken over by another worker', job['job_id'])
+        return
+    except Exception as e:
+        await connection.rollback()
+        logger.exception('job %s failed', job['job_id'])
+        await finish_job(connection, job, 'FAILED', str(e) or type(e).__name__)
+        return
+    await finish_job(connection, job, 'DONE')
+
+
+# started on application startup (see lifespan in main.py) and cancelled on shutdown. a job interrupted by
+# shutdown is rolled back to its last checkpoint and resumed after JOB_LEASE_TIMEOUT
+async def run_job_worker():
+    while True:
+        try:
+            async with pool.connection() as connection:
+                while (job := await claim_job(connection)) is not None:
+                    await run_job(connection, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('job worker failed')
+        # jobs enqueued by other processes are found by polling
+        try:
+            await asyncio.wait_for(jobs_enqueued.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        jobs_enqueued.clear()
+
+
+# /users/deactivateMany in the background: all users are deactivated first, so none of them is picked
+# as a replacement, then their pull requests are reassigned by JOB_BATCH_SIZE users.
+# progress is {deactivated, processed, total} users, result is reassignments by user
+async def deactivate_users_job(connection: AsyncConnection, job: dict):
+    users = job['payload']['users']
+    progress = job['progress']
+    if not progress.get('deactivated'):
+        teams = await select_query(connection, '''
+                                   SELECT DISTINCT team_name FROM "user" WHERE user_id = ANY(%(users)s)
+                                   ''', {'users': users})
+        await lock_users(connection, users)
+        await change_data_query(connection, 'UPDATE "user" SET is_active = FALSE WHERE user_id = ANY(%(users)s)',
+                                {'users': users})
+        await save_job_progress(connection, job, {**progress, 'deactivated': True})
+        team_cache.invalidate({team['team_name'] for team in teams or []})
+
+    for offset in range(job['progress']['processed'], len(users), JOB_BATCH_SIZE):
+        batch = users[offset:offset + JOB_BATCH_SIZE]
+        reassignment = await reassign_deactivated_reviewers(connection, batch)
+        if reassignment is None:
+            raise RuntimeError('unable to reassign pull requests')
+        reassign_responses, replacements = reassignment
+        await save_job_progress(connection, job, {**job['progress'], 'processed': offset + len(batch)},
+                                reassign_responses)
+        review_cache.invalidate({user_id for replacement in replacements for user_id in replacement[1:]})
+
+
+JOB_HANDLERS = {
+    DEACTIVATE_USERS_JOB: deactivate_users_job,
+}
@@ -0,0 +1,166 @@
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from variables import SLOW_QUERY_THRESHOLD_MS
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_logger = logging.getLogger('slow_query')
+
+
+# in-process prometheus histogram, one series per tuple of label values
+class Histogram:
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [counts per bucket (the last one is +Inf), sum]
+        self.series = {}
+
+    def observe(self, label_values: tuple, value: float):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in self.series.items():
+            labels = format_labels(self.label_names, label_values)
+            cumulative = 0
+            for bucket, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bucket}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.series = defaultdict(int)
+
+    def inc(self, label_values: tuple, value: int = 1):
+        self.series[label_values] += value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in self.series.items():
+            lines.append(f'{self.name}{{{format_labels(self.label_names, label_values)}}} {value}')
+        return lines
+
+
+def format_labels(label_names: tuple, label_values: tuple) -> str:
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(label_names, label_values))
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency including the response body',
+                                  ('method', 'route'), LATENCY_BUCKETS)
+http_responses = Counter('http_responses_total', 'HTTP responses by status code', ('method', 'route', 'status'))
+http_request_queries = Histogram('http_request_db_queries', 'Database queries executed per HTTP request',
+                                 ('method', 'route'), QUERIES_BUCKETS)
+db_query_duration = Histogram('db_query_duration_seconds', 'Database query latency by route and query kind',
+                              ('route', 'kind'), LATENCY_BUCKETS)
+db_query_rows = Histogram('db_query_rows', 'Rows returned (select) or changed (change) per database query',
+                          ('route', 'kind'), ROWS_BUCKETS)
+
+
+# per request state: matched route template and database queries executed while handling it
+class RequestMetrics:
+    __slots__ = ('route', 'queries')
+
+    def __init__(self):
+        self.route = 'unmatched'
+        self.queries = 0
+
+
+request_metrics: ContextVar[RequestMetrics | None] = ContextVar('request_metrics', default=None)
+
+
+# called by utils/db_queries.py after every query
+def record_query(kind: str, query: str, started: float, rows: int):
+    duration = time.perf_counter() - started
+    metrics = request_metrics.get()
+    route = 'background'
+    if metrics is not None:
+        metrics.queries += 1
+        route = metrics.route
+    db_query_duration.observe((route, kind), duration)
+    db_query_rows.observe((route, kind), rows)
+    if SLOW_QUERY_THRESHOLD_MS is not None and duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        slow_query_logger.warning('slow query: %.1f ms, %d rows, route %s: %s',
+                                  duration * 1000, rows, route, re.sub(r'\s+', ' ', query).strip())
+
+
+# pure ASGI middleware (it doesn't buffer streaming responses as BaseHTTPMiddleware does): latency is measured
+# until the last body chunk is sent, routes are labelled by their path template to keep series bounded
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            request_metrics.reset(token)
+            route = scope.get('route')
+            label_values = (scope['method'], route.path if route is not None else metrics.route)
+            http_request_duration.observe(label_values, duration)
+            http_request_queries.observe(label_values, metrics.queries)
+            http_responses.inc((*label_values, status))
+
+
+# route template is known only after routing, the dependency stores it for queries made by the request
+def set_request_route(route_path: str):
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.route = route_path
+
+
+# prometheus text exposition of the collected metrics, TTL caches counters and connection pools state,
+# pools_stats is {pool name: AsyncConnectionPool.get_stats()}
+def render_metrics(caches: tuple = (), pools_stats: dict | None = None) -> str:
+    lines = []
+    for metric in (http_request_duration, http_responses, http_request_queries, db_query_duration, db_query_rows):
+        lines.extend(metric.render())
+    for stat, metric_type in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                              ('coalesced', 'counter'), ('size', 'gauge')):
+        name = f'cache_{stat}_total' if metric_type == 'counter' else f'cache_{stat}'
+        lines.extend([f'# HELP {name} Response cache {stat}', f'# TYPE {name} {metric_type}'])
+        lines.extend(f'{name}{{cache="{cache.name}"}} {cache.stats()[stat]}' for cache in caches)
+    for stat in sorted({stat for pool_stats in (pools_stats or {}).values() for stat in pool_stats}):
+        lines.append(f'# TYPE db_pool_{stat} gauge')
+        lines.extend(f'db_pool_{stat}{{pool="{name}"}} {pool_stats[stat]}'
+                     for name, pool_stats in pools_stats.items() if stat in pool_stats)
+    return '\n'.join(lines) + '\n'
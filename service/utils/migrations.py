@@ -0,0 +1,63 @@
+import asyncio
+from pathlib import Path
+
+from psycopg import AsyncConnection
+
+from connection import pool
+
+
+# versioned schema migrations: every .sql file in ./migrations is applied once in the order of its name,
+# applied versions are stored in schema_migration table.
+# database/pr_assignment_ddl.sql is the initial schema, migrations are applied on top of it
+MIGRATIONS_PATH = Path(__file__).resolve().parent.parent / 'migrations'
+# any constant number, it's used to run migrations by one process when several workers start at once
+MIGRATIONS_LOCK_ID = 7_305_146
+
+
+async def apply_migrations(connection: AsyncConnection) -> list[str]:
+    await connection.execute('SELECT pg_advisory_lock(%(lock_id)s)', {'lock_id': MIGRATIONS_LOCK_ID})
+    try:
+        await connection.execute('''
+                                 CREATE TABLE IF NOT EXISTS schema_migration (
+                                     version TEXT PRIMARY KEY,
+                                     applied_at TIMESTAMP NOT NULL DEFAULT now()
+                                 )
+                                 ''')
+        await connection.commit()
+
+        cursor = await connection.execute('SELECT version FROM schema_migration')
+        applied_versions = {row['version'] for row in await cursor.fetchall()}
+
+        applied_now = []
+        for migration in sorted(MIGRATIONS_PATH.glob('*.sql')):
+            if migration.stem in applied_versions:
+                continue
+            # migration and its version are saved in one transaction
+            try:
+                await connection.execute(migration.read_text(encoding='utf-8'))
+                await connection.execute('INSERT INTO schema_migration (version) VALUES (%(version)s)',
+                                         {'version': migration.stem})
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+            applied_now.append(migration.stem)
+        return applied_now
+    finally:
+        await connection.execute('SELECT pg_advisory_unlock(%(lock_id)s)', {'lock_id': MIGRATIONS_LOCK_ID})
+        await connection.commit()
+
+
+async def main():
+    await pool.open(wait=True)
+    try:
+        async with pool.connection() as connection:
+            applied = await apply_migrations(connection)
+    finally:
+        await pool.close()
+    print('Applied migrations: ' + (', '.join(applied) if applied else 'none'))
+
+
+# python -m utils.migrations
+if __name__ == '__main__':
+    asyncio.run(main())
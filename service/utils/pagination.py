@@ -0,0 +1,78 @@
+import base64
+import binascii
+import json
+import time
+from typing import AsyncIterator
+from uuid import uuid4
+
+from fastapi.responses import StreamingResponse
+from psycopg import AsyncConnection
+
+from utils.db_queries import DatabaseSession, select_query, reader
+from utils.responses import dumps
+from utils.metrics import record_query
+from variables import STREAM_BATCH_SIZE
+
+
+# keyset pagination: queries used here are ordered by a unique key and contain
+#     (%(after)s::text IS NULL OR <key> > %(after)s) ... ORDER BY <key> LIMIT %(limit)s
+# cursor token is the key of the last returned row, so every page is an index range scan
+# no matter how deep the client has paginated
+
+PAGE_LIMIT_MAX = 1000
+
+
+# it's turned into 400 response by exception handler in main.py
+class InvalidCursorError(ValueError):
+    pass
+
+
+def decode_cursor(cursor: str | None) -> str | None:
+    if cursor is None:
+        return None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InvalidCursorError('invalid cursor') from e
+    if not isinstance(after, str):
+        raise InvalidCursorError('invalid cursor')
+    return after
+
+
+def encode_cursor(after: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+
+async def select_page(connection: DatabaseSession | AsyncConnection, query: str, parameters: dict, key: str,
+                      limit: int, cursor: str | None) -> tuple[list, str | None]:
+    # one extra row tells if there is a next page. paginated queries are fixed per endpoint, so they are prepared
+    rows = await select_query(connection, query, {**parameters, 'after': decode_cursor(cursor), 'limit': limit + 1},
+                              prepare=True)
+    rows = rows or []
+    next_cursor = encode_cursor(rows[limit - 1][key]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# rows are read from a server-side cursor by STREAM_BATCH_SIZE and sent to the client as they arrive,
+# one JSON object per line, so memory usage doesn't depend on result size
+async def stream_rows(connection: DatabaseSession | AsyncConnection, query: str,
+                      parameters: dict) -> AsyncIterator[bytes]:
+    started = time.perf_counter()
+    rows = 0
+    async with (await reader(connection)).cursor(name=f'stream_{uuid4().hex}') as cursor:
+        cursor.itersize = STREAM_BATCH_SIZE
+        await cursor.execute(query, parameters)
+        async for row in cursor:
+            rows += 1
+            yield dumps(row) + b'\n'
+    record_query('stream', query, started, rows)
+    # named cursor lives in a transaction, it's not needed anymore
+    await connection.commit()
+
+
+def ndjson_response(connection: DatabaseSession | AsyncConnection, query: str, parameters: dict, limit: int | None,
+                    cursor: str | None) -> StreamingResponse:
+    return StreamingResponse(
+        stream_rows(connection, query, {**parameters, 'after': decode_cursor(cursor), 'limit': limit}),
+        media_type='application/x-ndjson'
+    )
@@ -9,6 +9,7 @@ class ErrorCodes(Enum):
     NOT_ASSIGNED = 'NOT_ASSIGNED'
     NO_CANDIDATE = 'NO_CANDIDATE'
     NOT_FOUND = 'NOT_FOUND'
+    BAD_REQUEST = 'BAD_REQUEST'
     SERVER_ERROR = 'SERVER_ERROR'
 
 
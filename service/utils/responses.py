@@ -0,0 +1,20 @@
+from typing import Any
+
+import orjson
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+
+# orjson options to render naive datetimes the same way as JSON_DATETIME_FORMAT: 2025-01-31T12:00:00Z
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_OMIT_MICROSECONDS
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+# drop-in replacement for starlette JSONResponse rendered with orjson: datetimes and dataclasses
+# (row records from utils/schemas.py) are serialized natively, without conversion to dicts and strings.
+# it's also the default response class of the application
+class JSONResponse(StarletteJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
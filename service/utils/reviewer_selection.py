@@ -0,0 +1,312 @@
+import heapq
+
+from psycopg import AsyncConnection
+
+from utils.db_queries import DatabaseSession, select_query, change_data_query
+from utils.properties import ErrorCodes
+from utils.schemas import ErrorResponse, Error
+
+
+# reviewers are chosen by the least amount of open pull requests they review (open_reviews column of "user"),
+# active members of a team are kept ordered by this counter with user_team_load_idx partial index,
+# so picking N least loaded reviewers is an index range scan with LIMIT, not a scan over the whole team.
+# deactivated users drop out of the index automatically, that's why /users/setIsActive needs no extra work here
+# reassign_pull_request database function (migrations/0009_ordered_user_locks.sql) uses the same ordering
+
+
+# hot path queries, tests/test_indexes.py checks that their plans use the indexes
+PICK_REVIEWERS_QUERY = '''
+                       SELECT user_id FROM "user"
+                       WHERE team_name = %(team_name)s AND is_active = TRUE AND
+                           user_id <> ALL(%(excluded_users)s)
+                       ORDER BY open_reviews, user_id
+                       LIMIT %(amount)s
+                       '''
+
+DEACTIVATED_REVIEWS_QUERY = '''
+                            SELECT a.reviewer_id, u.team_name, pr.pull_request_id,
+                                pr.pull_request_name, pr.author_id, pr.status, pr.created_at,
+                                ARRAY(SELECT ra.reviewer_id FROM "assignment" ra
+                                      WHERE ra.pull_request_id = pr.pull_request_id
+                                      ORDER BY ra.reviewer_id) AS assigned_reviewers
+                            FROM "assignment" a
+                            JOIN pull_request pr ON pr.pull_request_id = a.pull_request_id
+                            JOIN "user" u ON u.user_id = a.reviewer_id
+                            WHERE a.reviewer_id = ANY(%(users)s) AND pr.status = 'OPEN'
+                            ORDER BY pr.pull_request_id
+                            '''
+
+
+async def pick_reviewers(connection: DatabaseSession | AsyncConnection, team_name: str, amount: int,
+                         excluded_users: list[str]) -> list[str]:
+    reviewers = await select_query(connection, PICK_REVIEWERS_QUERY, {
+        'team_name': team_name, 'excluded_users': excluded_users, 'amount': amount
+    }, prepare=True)
+    return [] if reviewers is None else [reviewer['user_id'] for reviewer in reviewers]
+
+
+# rows of users are locked in user_id order before they are changed, by database functions too
+# (migrations/0009_ordered_user_locks.sql), so requests changing the same users in a different order
+# wait for each other instead of deadlocking. FOR NO KEY UPDATE is the lock the following UPDATE takes anyway,
+# FOR UPDATE would also conflict with KEY SHARE locks which foreign key checks of inserted assignments keep
+# on the same users until the commit, two such transactions would deadlock
+async def lock_users(connection: DatabaseSession | AsyncConnection, user_ids: list[str]):
+    await select_query(connection, '''
+                       SELECT user_id FROM "user" WHERE user_id = ANY(%(user_ids)s) ORDER BY user_id
+                       FOR NO KEY UPDATE
+                       ''', {'user_ids': user_ids}, prepare=True, primary=True)
+
+
+# lock all members of teams in the same user_id order, for changes whose users are known only after the lock,
+# like replacements of deactivated reviewers chosen among their teammates
+async def lock_team_members(connection: DatabaseSession | AsyncConnection, team_names: list[str]):
+    await select_query(connection, '''
+                       SELECT user_id FROM "user" WHERE team_name = ANY(%(team_names)s) ORDER BY user_id
+                       FOR NO KEY UPDATE
+                       ''', {'team_names': team_names}, prepare=True, primary=True)
+
+
+# apply open reviews counter changes for many users with one statement, load_changes is {user_id: delta}
+async def update_reviewers_load(connection: DatabaseSession | AsyncConnection, load_changes: dict[str, int]) -> bool:
+    load_changes = {user_id: delta for user_id, delta in load_changes.items() if delta != 0}
+    if not load_changes:
+        return True
+    await lock_users(connection, list(load_changes.keys()))
+    return await change_data_query(connection, '''
+                                   UPDATE "user" u SET open_reviews = u.open_reviews + c.delta
+                                   FROM unnest(%(user_ids)s::text[], %(deltas)s::integer[]) AS c(user_id, delta)
+                                   WHERE u.user_id = c.user_id
+                                   ''', {'user_ids': list(load_changes.keys()), 'deltas': list(load_changes.values())},
+                                   prepare=True)
+
+
+# in-memory version of the same ordering for bulk operations: team rosters are loaded once with their load
+# and every pick updates the heap, so many pull requests of one batch are spread over the team
+class TeamLoadQueue:
+    def __init__(self, members: list[dict]):
+        # members are rows with user_id, team_name and open_reviews of active users
+        self.teams = {}
+        for member in members:
+            self.teams.setdefault(member['team_name'], []).append((member['open_reviews'], member['user_id']))
+        for team in self.teams.values():
+            heapq.heapify(team)
+        # accumulated counter changes to be saved with update_reviewers_load
+        self.load_changes = {}
+
+    @classmethod
+    async def load(cls, connection: DatabaseSession | AsyncConnection, team_names: list[str]) -> 'TeamLoadQueue':
+        members = await select_query(connection, '''
+                                     SELECT user_id, team_name, open_reviews FROM "user"
+                                     WHERE team_name = ANY(%(team_names)s) AND is_active = TRUE
+                                     ''', {'team_names': team_names})
+        return cls(members or [])
+
+    def pick(self, team_name: str, amount: int, excluded_users: list[str] | set[str]) -> list[str]:
+        team = self.teams.get(team_name, [])
+        picked, skipped = [], []
+        while team and len(picked) < amount:
+            load, user_id = heapq.heappop(team)
+            if user_id in excluded_users:
+                skipped.append((load, user_id))
+            else:
+                picked.append((load, user_id))
+        for load, user_id in skipped:
+            heapq.heappush(team, (load, user_id))
+        for load, user_id in picked:
+            heapq.heappush(team, (load + 1, user_id))
+            self.load_changes[user_id] = self.load_changes.get(user_id, 0) + 1
+        return [user_id for _, user_id in picked]
+
+    # reviewer left a pull request, it's used for users who are not in the queue (e.g. deactivated ones)
+    def release(self, user_id: str):
+        self.load_changes[user_id] = self.load_changes.get(user_id, 0) - 1
+
+
+# lock open pull requests reviewed by users, so concurrent reassigns can't change their reviewers.
+# it's a separate statement: rows read after it see the reviewers committed by the requests it waited for
+async def lock_reviewed_pull_requests(connection: DatabaseSession | AsyncConnection, users: list[str]):
+    await select_query(connection, '''
+                       SELECT pr.pull_request_id FROM pull_request pr
+                       WHERE pr.status = 'OPEN' AND pr.pull_request_id IN (
+                           SELECT a.pull_request_id FROM "assignment" a WHERE a.reviewer_id = ANY(%(users)s)
+                       )
+                       ORDER BY pr.pull_request_id
+                       FOR UPDATE
+                       ''', {'users': users})
+
+
+# reassign open pull requests reviewed by already deactivated users to the least loaded active teammates,
+# it's done with a fixed number of set-based queries regardless of users amount and is not committed here.
+# returns reassign responses of /users/deactivateMany by user and applied (pull_request_id, old, new) replacements,
+# None if replacements couldn't be applied. if reassign is not possible, reviewer stays assigned and
+# NO_CANDIDATE error is returned for this pull request.
+# with lock_pull_requests=False the caller must have already locked them with lock_reviewed_pull_requests
+async def reassign_deactivated_reviewers(connection: DatabaseSession | AsyncConnection, users: list[str],
+                                         lock_pull_requests: bool = True
+                                         ) -> tuple[dict, list[tuple[str, str, str]]] | None:
+    if lock_pull_requests:
+        await lock_reviewed_pull_requests(connection, users)
+    # get opened pull requests where deactivated users are reviewers together with all their current reviewers
+    assigned_requests = await select_query(connection, DEACTIVATED_REVIEWS_QUERY, {'users': users})
+    if assigned_requests is None:
+        return {}, []
+
+    # get active members of every touched team with their review load with one query,
+    # deactivated users are already excluded
+    team_load_queue = await TeamLoadQueue.load(connection, list({pr['team_name'] for pr in assigned_requests}))
+
+    # compute all replacements in memory, reviewers of a pull request are updated as we go,
+    # so two deactivated reviewers of the same pull request don't get the same replacement
+    pull_request_reviewers = {pr['pull_request_id']: pr['assigned_reviewers'] for pr in assigned_requests}
+    requests_by_user = {}
+    for pr in assigned_requests:
+        requests_by_user.setdefault(pr['reviewer_id'], []).append(pr)
+
+    reassign_responses = {}
+    replacements = []
+    for user_id in users:
+        if user_id not in requests_by_user:
+            continue
+        reassign_responses[user_id] = []
+        for pr in requests_by_user[user_id]:
+            reviewers = pull_request_reviewers[pr['pull_request_id']]
+            reassign_candidates = team_load_queue.pick(pr['team_name'], 1, {pr['author_id'], *reviewers})
+            if not reassign_candidates:
+                reassign_responses[user_id].append(ErrorResponse(Error(
+                    code=ErrorCodes.NO_CANDIDATE, message='no active replacement in team'
+                )).__dict__())
+                continue
+
+            reassign_candidate = reassign_candidates[0]
+            team_load_queue.release(user_id)
+            reviewers[reviewers.index(user_id)] = reassign_candidate
+            replacements.append((pr['pull_request_id'], user_id, reassign_candidate))
+            reassign_responses[user_id].append({
+                'pr': {
+                    'pull_request_id': pr['pull_request_id'],
+                    'pull_request_name': pr['pull_request_name'],
+                    'author_id': pr['author_id'],
+                    'status': pr['status'],
+                    'assigned_reviewers': list(reviewers),
+                    'createdAt': pr['created_at'],
+                    'mergedAt': None,
+                },
+                'replaced_by': reassign_candidate})
+
+    if replacements and not await apply_replacements(connection, replacements, team_load_queue.load_changes):
+        return None
+    return reassign_responses, replacements
+
+
+# replace reviewers of many pull requests with one statement and save the load changes, replacements are
+# (pull_request_id, old_reviewer_id, new_reviewer_id). False if none of the assignments was found
+async def apply_replacements(connection: DatabaseSession | AsyncConnection, replacements: list[tuple[str, str, str]],
+                             load_changes: dict[str, int]) -> bool:
+    pull_request_ids, old_reviewer_ids, new_reviewer_ids = map(list, zip(*replacements))
+    if not await change_data_query(connection, '''
+                                   UPDATE "assignment" a SET reviewer_id = r.new_reviewer_id
+                                   FROM unnest(%(pull_request_ids)s::text[], %(old_reviewer_ids)s::text[],
+                                               %(new_reviewer_ids)s::text[])
+                                       AS r(pull_request_id, old_reviewer_id, new_reviewer_id)
+                                   WHERE a.pull_request_id = r.pull_request_id AND a.reviewer_id = r.old_reviewer_id
+                                   ''', {'pull_request_ids': pull_request_ids, 'old_reviewer_ids': old_reviewer_ids,
+                                         'new_reviewer_ids': new_reviewer_ids}):
+        return False
+    return await update_reviewers_load(connection, load_changes)
+
+
+# balanced reassignment of a team's open reviews, computed in memory. members are rows with user_id, is_active and
+# open_reviews of the team, pull_requests are rows with pull_request_id, author_id and assigned_reviewers of all
+# open pull requests reviewed by them. reviews of inactive members are given to the least loaded active ones,
+# then the most loaded active member gives a review to the least loaded one while their loads differ by 2 or more.
+# a new reviewer is never the author or a current or original reviewer of the pull request, so the replacements
+# don't collide when they are applied with one statement.
+# members are kept in heaps by load, entries of members whose load has changed are skipped, so a move costs
+# O(log members) instead of sorting the team and its reviews again.
+# returns replacements (pull_request_id, old_reviewer_id, new_reviewer_id) and load changes of members
+def plan_rebalance(members: list[dict],
+                   pull_requests: list[dict]) -> tuple[list[tuple[str, str, str]], dict[str, int]]:
+    open_reviews = {member['user_id']: member['open_reviews'] for member in members}
+    load = dict(open_reviews)
+    active = sorted(member['user_id'] for member in members if member['is_active'])
+    active_members = set(active)
+    inactive = sorted(member['user_id'] for member in members if not member['is_active'])
+    # open reviews by reviewer, {pull_request_id: pull request}
+    reviews = {user_id: {} for user_id in load}
+    # users who can't get a review of the pull request by pull_request_id
+    excluded = {}
+    for pr in sorted(pull_requests, key=lambda pr: pr['pull_request_id']):
+        pr['assigned_reviewers'] = list(pr['assigned_reviewers'])
+        excluded[pr['pull_request_id']] = {pr['author_id'], *pr['assigned_reviewers']}
+        for reviewer in pr['assigned_reviewers']:
+            if reviewer in reviews:
+                reviews[reviewer][pr['pull_request_id']] = pr
+    # reviewer before rebalancing by (pull_request_id, current reviewer), a review moved twice is one replacement
+    original_reviewers = {}
+
+    # (load, user_id) of active members, the least loaded first, and (-load, user_id), the most loaded first
+    receivers = [(load[user_id], user_id) for user_id in active]
+    donors = [(-load[user_id], user_id) for user_id in active]
+    heapq.heapify(receivers)
+    heapq.heapify(donors)
+    # members who can't give any review at their current load
+    stuck = set()
+
+    def pick(pr: dict, below_load: float) -> str | None:
+        picked, skipped = None, []
+        while receivers and receivers[0][0] < below_load:
+            user_load, user_id = heapq.heappop(receivers)
+            if user_load != load[user_id]:
+                continue
+            if user_id not in excluded[pr['pull_request_id']]:
+                picked = user_id
+                break
+            skipped.append((user_load, user_id))
+        for entry in skipped:
+            heapq.heappush(receivers, entry)
+        return picked
+
+    def move(pr: dict, old_reviewer: str, new_reviewer: str):
+        pr['assigned_reviewers'][pr['assigned_reviewers'].index(old_reviewer)] = new_reviewer
+        del reviews[old_reviewer][pr['pull_request_id']]
+        reviews[new_reviewer][pr['pull_request_id']] = pr
+        excluded[pr['pull_request_id']].add(new_reviewer)
+        load[old_reviewer] -= 1
+        load[new_reviewer] += 1
+        for user_id in (old_reviewer, new_reviewer):
+            if user_id in active_members:
+                heapq.heappush(receivers, (load[user_id], user_id))
+                heapq.heappush(donors, (-load[user_id], user_id))
+                stuck.discard(user_id)
+        # the old reviewer may take a review from members that couldn't give one before
+        for user_id in [user_id for user_id in stuck if load[user_id] - load[old_reviewer] >= 2]:
+            heapq.heappush(donors, (-load[user_id], user_id))
+            stuck.discard(user_id)
+        original_reviewers[(pr['pull_request_id'], new_reviewer)] = \
+            original_reviewers.pop((pr['pull_request_id'], old_reviewer), old_reviewer)
+
+    for user_id in inactive:
+        for pr in list(reviews[user_id].values()):
+            new_reviewer = pick(pr, float('inf'))
+            if new_reviewer is not None:
+                move(pr, user_id, new_reviewer)
+
+    # the most loaded member gives one review and is pushed back with its new load. a member that can't give
+    # any review is stuck until its load changes or another member's load drops 2 below it.
+    # every move lowers the sum of squared loads, so the loop ends
+    while donors:
+        negative_load, user_id = heapq.heappop(donors)
+        if -negative_load != load[user_id] or user_id in stuck:
+            continue
+        for pr in reviews[user_id].values():
+            new_reviewer = pick(pr, load[user_id] - 1)
+            if new_reviewer is not None:
+                move(pr, user_id, new_reviewer)
+                break
+        else:
+            stuck.add(user_id)
+
+    replacements = sorted((pull_request_id, original_reviewer, reviewer)
+                          for (pull_request_id, reviewer), original_reviewer in original_reviewers.items())
+    return replacements, {user_id: load[user_id] - open_reviews[user_id] for user_id in load
+                          if load[user_id] != open_reviews[user_id]}
@@ -0,0 +1,43 @@
+import math
+
+
+# buckets per unit of ln(1 + seconds), must match merge_time_bucket in migrations/0006_review_rollups.sql
+MERGE_TIME_BUCKETS_PER_E = 20
+MERGE_TIME_PERCENTILES = (50, 75, 90, 95, 99)
+
+
+def bucket_lower_bound(bucket: int) -> float:
+    return math.exp(bucket / MERGE_TIME_BUCKETS_PER_E) - 1
+
+
+# time to merge summary from histogram rows ({bucket, pull_requests, seconds_sum}) of one team or author:
+# percentiles are interpolated inside their bucket, so the error is bounded by the bucket width (about 5%)
+def merge_time_summary(histogram: list[dict]) -> dict:
+    histogram = sorted(histogram, key=lambda row: row['bucket'])
+    merged = sum(row['pull_requests'] for row in histogram)
+    summary = {'merged': merged, 'mean_seconds': None, 'percentiles_seconds': None}
+    if not merged:
+        return summary
+
+    summary['mean_seconds'] = round(sum(row['seconds_sum'] for row in histogram) / merged, 1)
+    percentiles = {}
+    for percentile in MERGE_TIME_PERCENTILES:
+        rank = merged * percentile / 100
+        cumulative = 0
+        for row in histogram:
+            if cumulative + row['pull_requests'] >= rank:
+                lower, upper = bucket_lower_bound(row['bucket']), bucket_lower_bound(row['bucket'] + 1)
+                percentiles[f'p{percentile}'] = round(lower + (upper - lower) *
+                                                      (rank - cumulative) / row['pull_requests'], 1)
+                break
+            cumulative += row['pull_requests']
+    summary['percentiles_seconds'] = percentiles
+    return summary
+
+
+# histogram rows of many teams or authors grouped by key
+def merge_time_summaries(histograms: list[dict], key: str) -> dict[str, dict]:
+    grouped = {}
+    for row in histograms:
+        grouped.setdefault(row[key], []).append(row)
+    return {name: merge_time_summary(rows) for name, rows in grouped.items()}
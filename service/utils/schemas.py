@@ -43,6 +43,13 @@ class PullRequest:
     mergedAt: datetime | None = None
 
 
+@dataclass
+class PullRequestCreate:
+    pull_request_id: str
+    pull_request_name: str
+    author_id: str
+
+
 @dataclass
 class PullRequestShort:
     pull_request_id: str
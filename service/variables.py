@@ -10,8 +10,64 @@ DB_PORT = int(os.getenv("DB_PORT"))
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# seconds to wait for a free pooled connection
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+# executions of the same query before it's prepared on the connection, "none" disables prepared statements
+# (e.g. behind pgbouncer in transaction mode). at most DB_PREPARED_MAX statements are kept prepared per connection,
+# the least recently used ones are deallocated
+DB_PREPARE_THRESHOLD = None if os.getenv("DB_PREPARE_THRESHOLD", "5").lower() == "none" else \
+    int(os.getenv("DB_PREPARE_THRESHOLD", 5))
+DB_PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", 100))
+# connection string (libpq key=value or postgresql:// URI) of a read replica, reads of read-only requests go there.
+# unset - all queries go to the primary database
+DB_READ_DSN = os.getenv("DB_READ_DSN") or None
+# apply schema migrations from ./migrations on startup, they can also be applied with python -m utils.migrations
+DB_APPLY_MIGRATIONS = os.getenv("DB_APPLY_MIGRATIONS", "true").lower() == "true"
 
 APP_HOST = os.getenv("APP_HOST")
 APP_PORT = int(os.getenv("APP_PORT"))
+# worker processes, each one has its own event loop, connection pool, caches and metrics
+APP_WORKERS = int(os.getenv("APP_WORKERS", 1))
+# event loop (auto, asyncio or uvloop) and HTTP parser (auto, h11 or httptools), auto uses uvloop and httptools
+# when they are installed
+APP_LOOP = os.getenv("APP_LOOP", "auto")
+APP_HTTP = os.getenv("APP_HTTP", "auto")
+# seconds in-flight requests are given to finish on shutdown (SIGTERM/SIGINT) before connections are closed
+APP_GRACEFUL_SHUTDOWN_TIMEOUT = float(os.getenv("APP_GRACEFUL_SHUTDOWN_TIMEOUT", 30))
+# seconds an idle keep-alive connection is kept open
+APP_KEEP_ALIVE_TIMEOUT = int(os.getenv("APP_KEEP_ALIVE_TIMEOUT", 5))
+
+# rows fetched from a server-side cursor per round trip in streaming (NDJSON) responses
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+
+# team rosters and review queues cache, entries per cache and seconds an entry lives
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 10000))
+CACHE_TTL = float(os.getenv("CACHE_TTL", 30))
+# seconds before sending cache invalidations to other processes or listening to them is retried after an error
+CACHE_INVALIDATION_RETRY_INTERVAL = float(os.getenv("CACHE_INVALIDATION_RETRY_INTERVAL", 1))
+# seconds a statistics response is reused by identical requests after its query has finished (micro-TTL),
+# 0 - only identical requests that arrive while the query is running share it
+COALESCE_TTL = float(os.getenv("COALESCE_TTL", 0))
+
+# queries slower than this many milliseconds are logged with their SQL text, unset to disable the slow query log
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS")) if os.getenv("SLOW_QUERY_THRESHOLD_MS") else None
+
+# merged pull requests older than this many days are moved to the archive tables (migrations/0007), in batches of
+# ARCHIVE_BATCH_SIZE, every ARCHIVE_INTERVAL seconds by each worker. 0 disables the periodic archival,
+# it can also be run with python -m utils.archive
+ARCHIVE_MERGED_AFTER_DAYS = float(os.getenv("ARCHIVE_MERGED_AFTER_DAYS", 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))
+
+# background jobs (migrations/0008_job_queue.sql): worker tasks per process, items (e.g. users) per committed batch,
+# seconds between polls for jobs enqueued by other processes, seconds without a checkpoint after which a running job
+# is considered abandoned and claimed again, and claims of a job before it's failed
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 100))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
 
 JSON_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"